@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+# An asyncio version of the request functions in simple_gitlab, for
+# scripts that need to send many API requests at once without a thread for
+# each of them. It needs Python 3.7 or higher.
+#
+# The functions here are coroutines and take the same arguments as the
+# ones in simple_gitlab, except that the get_*_by_name functions don't take
+# a python-gitlab object and return dictionaries (the JSON from Gitlab)
+# instead of python-gitlab objects. They share simple_gitlab's private
+# token, name cache and request metrics.
+#
+# At most config.api_max_in_flight requests are sent at once. Scripts that
+# aren't written with asyncio can use run() or request_many():
+#
+#     results = async_gitlab.request_many(['projects/%d' % i for i in project_ids])
+
+import asyncio
+import email.parser
+import http.client
+import json,sys,time
+import urllib.error,urllib.parse
+import simple_gitlab
+import config
+from config import host_url
+
+
+# ------Connection pool------
+# Same idea as simple_gitlab.HTTPConnectionPool, using asyncio streams.
+# Keep-alive connections are reused, at most max_size connections are open
+# to one host, and idle ones are closed after idle_timeout seconds.
+# A pool belongs to the event loop it was first used in.
+class AsyncConnectionPool:
+    redirect_codes = (301, 302, 303, 307, 308)
+    max_redirects = 5
+
+    def __init__(self, max_size=config.http_pool_size, idle_timeout=config.http_pool_idle_timeout,
+                 timeout=config.http_timeout):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = {}   # (scheme, host, port) -> list of (reader, writer, time last used)
+        self._slots = {}  # (scheme, host, port) -> asyncio.Semaphore bounding open connections
+
+    # Sends one request and reads the whole response.
+    # Returns a simple_gitlab.HTTPResponse. Raises urllib.error.HTTPError
+    # for 4xx and 5xx responses, like simple_gitlab.HTTPConnectionPool.
+    async def urlopen(self, method, url, body=None, headers={}):
+        for redirect in range(self.max_redirects + 1):
+            response = await asyncio.wait_for(self._send(method, url, body, headers), self.timeout)
+            location = response.headers.get('Location')
+            if response.status in self.redirect_codes and location and method in ('GET', 'HEAD'):
+                url = urllib.parse.urljoin(url, location)
+                continue
+            break
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return response
+
+    async def _send(self, method, url, body, headers):
+        parts = urllib.parse.urlsplit(url)
+        default_port = 443 if parts.scheme == 'https' else 80
+        key = (parts.scheme, parts.hostname, parts.port or default_port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_head = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % parts.netloc]
+        for name, value in headers.items():
+            request_head.append('%s: %s' % (name, value))
+        if body is not None or method in ('POST', 'PUT', 'PATCH'):
+            request_head.append('Content-Length: %d' % len(body or b''))
+        request_bytes = ('\r\n'.join(request_head) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+        if key not in self._slots:
+            self._slots[key] = asyncio.Semaphore(self.max_size)
+        async with self._slots[key]:
+            while True:
+                reader, writer, reused = await self._get_connection(key)
+                try:
+                    writer.write(request_bytes)
+                    await writer.drain()
+                    response, keep_alive = await self._read_response(reader, method)
+                except (ConnectionError, asyncio.IncompleteReadError, http.client.RemoteDisconnected):
+                    writer.close()
+                    if reused:
+                        # The server closed the kept-alive connection. Try a new one.
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self._idle.setdefault(key, []).append((reader, writer, time.monotonic()))
+                else:
+                    writer.close()
+                return response
+
+    async def _get_connection(self, key):
+        now = time.monotonic()
+        idle = self._idle.get(key, [])
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if now - last_used <= self.idle_timeout and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        reader, writer = await asyncio.open_connection(host, port, ssl=(scheme == 'https') or None)
+        return reader, writer, False
+
+    # Returns (simple_gitlab.HTTPResponse, whether the connection can be reused)
+    async def _read_response(self, reader, method):
+        status_line = (await reader.readline()).decode('latin-1')
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        version, status, reason = (status_line.rstrip('\r\n').split(' ', 2) + [''])[:3]
+        status = int(status)
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line.decode('latin-1'))
+        headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(''.join(header_lines))
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('Connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            data = b''
+        elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip any trailer headers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b''.join(chunks)
+        elif headers.get('Content-Length') is not None:
+            data = await reader.readexactly(int(headers['Content-Length']))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return simple_gitlab.HTTPResponse(status, reason, headers, data), keep_alive
+
+    def close_all(self):
+        for idle in self._idle.values():
+            for reader, writer, last_used in idle:
+                writer.close()
+        self._idle = {}
+
+http_pool = None
+request_semaphore = None
+semaphore_loop = None
+
+# The pool and the semaphore belong to one event loop, so new ones are
+# made whenever a different loop is running (ex. each call to run()).
+def loop_resources():
+    global http_pool, request_semaphore, semaphore_loop
+    loop = asyncio.get_running_loop()
+    if semaphore_loop is not loop:
+        http_pool = AsyncConnectionPool()
+        request_semaphore = asyncio.Semaphore(config.api_max_in_flight or config.http_pool_size)
+        semaphore_loop = loop
+    return http_pool, request_semaphore
+
+
+# Same as simple_gitlab.request, as a coroutine. Uses the same
+# simple_gitlab.retry_policy and circuit_breaker.
+async def request(query, post_hash={}, query_headers={}, http_method=None, quit_on_error=False, max_attempts=None, show_output=True,
+                  return_headers=False, post_json=None, retry=None):
+    pool, semaphore = loop_resources()
+    policy = retry or simple_gitlab.retry_policy
+    circuit_breaker = simple_gitlab.circuit_breaker
+    max_tries = max_attempts or policy.max_attempts
+    url = host_url + "/api/v3/" + query
+    method, post_data, headers = simple_gitlab.request_data(post_hash, post_json, query_headers, http_method)
+    for request_attempt in range(1, max_tries + 1):
+        while circuit_breaker.pause_remaining() > 0:
+            await asyncio.sleep(circuit_breaker.pause_remaining())
+        try:
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    response = await pool.urlopen(method, url, body=post_data, headers=headers)
+                except Exception as e:
+                    simple_gitlab.request_metrics.record(method, url, getattr(e, 'code', None),
+                                                         time.monotonic() - started, len(post_data or b''), 0,
+                                                         request_attempt, str(e))
+                    raise
+                simple_gitlab.request_metrics.record(method, url, response.status, time.monotonic() - started,
+                                                     len(post_data or b''), len(response.data), request_attempt)
+        except Exception as e:
+            if show_output:
+                print("Error occurred trying to access " + url)
+                print("Error %s message: %s" % (type(e).__name__, str(e)))
+            retry_after = simple_gitlab.retry_after_seconds(e)
+            if isinstance(e, asyncio.TimeoutError) or simple_gitlab.is_overload(e):
+                circuit_breaker.record_overload(retry_after, show_output)
+            if request_attempt < max_tries and \
+                    (policy.should_retry(method, e) or
+                     (isinstance(e, asyncio.TimeoutError) and method in policy.idempotent_methods)):
+                delay = policy.delay(request_attempt, retry_after)
+                if show_output: print("Retrying in %.1f seconds... (re-try number %d)" % (delay, request_attempt))
+                await asyncio.sleep(delay)
+                continue
+            if show_output: print("Request failed after %d attempts" % request_attempt)
+            if quit_on_error:
+                sys.exit(1)
+            return (False, None) if return_headers else False
+        circuit_breaker.record_success()
+        json_string = response.data.decode('utf-8')
+        try:
+            python_object = json.loads(json_string)
+        except Exception as e:
+            if show_output:
+                print(json_string)
+                print("Error occurred trying to interpret above data as JSON.")
+                print("Error message: %s" % str(e))
+            if quit_on_error:
+                sys.exit(1)
+            else:
+                return (False, None) if return_headers else False
+        if return_headers:
+            return python_object, response.headers
+        return python_object
+
+# Same as simple_gitlab.request_pages, as an async generator:
+#     async for event in async_gitlab.request_pages('projects/5/events'):
+# Raises simple_gitlab.PageRequestError if a page can't be gotten.
+async def request_pages(query, per_page=100, **request_args):
+    separator = '&' if '?' in query else '?'
+    first_page_query = query + separator + 'per_page=%d' % per_page
+    page_query = first_page_query
+    while page_query:
+        items, headers = await request(page_query, return_headers=True, **request_args)
+        if items is False:
+            raise simple_gitlab.PageRequestError("Could not get %s" % page_query)
+        if not items:
+            return
+        for item in items:
+            yield item
+        page_query = simple_gitlab.next_page_query(first_page_query, headers)
+
+# Same as simple_gitlab.get_group_id
+async def get_group_id(group_name):
+    return simple_gitlab.find_group_id(await request('groups', quit_on_error=True), group_name)
+
+
+# ------Lookups by name------
+# These use simple_gitlab.name_cache, so things looked up by either module
+# are only looked up once.
+
+# Returns the cached attributes for (kind, key), or None
+def cached_attributes(kind, key):
+    obj = simple_gitlab.name_cache.get(kind, key)
+    if obj is None or isinstance(obj, dict):
+        return obj
+    return obj.attributes
+
+# Same as simple_gitlab.get_group_by_name
+async def get_group_by_name(name):
+    group = cached_attributes('groups', name)
+    if group:
+        return group
+    groups = [group for group in await request_all('groups?search=%s' % urllib.parse.quote(name))
+              if group['name'] == name]
+    simple_gitlab.bad_search_check(groups, "groups", name)
+    simple_gitlab.name_cache.put('groups', name, groups[0])
+    return groups[0]
+
+# Same as simple_gitlab.get_user_by_name
+async def get_user_by_name(name):
+    user = cached_attributes('users', name)
+    if user:
+        return user
+    users = [user for user in await request_all('users?username=%s' % urllib.parse.quote(name))
+             if user['username'] == name]
+    simple_gitlab.bad_search_check(users, "users", name)
+    simple_gitlab.name_cache.put('users', name, users[0])
+    return users[0]
+
+# Same as simple_gitlab.load_all_users
+async def load_all_users():
+    if simple_gitlab.name_cache.is_loaded('users'):
+        return
+    for user in await request_all('users'):
+        simple_gitlab.name_cache.put('users', user['username'], user)
+    simple_gitlab.name_cache.mark_loaded('users')
+
+# Same as simple_gitlab.get_project_by_name
+async def get_project_by_name(name, g_name=None):
+    if g_name:
+        group = await get_group_by_name(g_name)
+        if not simple_gitlab.name_cache.is_loaded('projects', g_name):
+            for project in await request_all('groups/%d/projects' % group['id']):
+                simple_gitlab.name_cache.put('projects', (g_name, project['name']), project)
+            simple_gitlab.name_cache.mark_loaded('projects', g_name)
+        project = cached_attributes('projects', (g_name, name))
+        if project:
+            return project
+        query = 'groups/%d/projects?search=%s' % (group['id'], urllib.parse.quote(name))
+    else:
+        project = cached_attributes('projects', (None, name))
+        if project:
+            return project
+        query = 'projects?search=%s' % urllib.parse.quote(name)
+    projects = [project for project in await request_all(query) if project['name'] == name]
+    simple_gitlab.bad_search_check(projects, "projects", name)
+    simple_gitlab.name_cache.put('projects', (g_name, name), projects[0])
+    return projects[0]
+
+# Returns every item of a list query as one list. Raises
+# simple_gitlab.PageRequestError if any page can't be gotten.
+async def request_all(query, **request_args):
+    return [item async for item in request_pages(query, **request_args)]
+
+
+# ------Sync wrappers------
+
+# Runs a coroutine from normal (not asyncio) code and returns its result
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+# Sends all the queries at once (up to config.api_max_in_flight at a time)
+# and returns their results in the same order, like calling
+# simple_gitlab.request on each of them.
+# Input: queries: a list of queries
+#        Any keyword arguments are passed to request()
+def request_many(queries, **request_args):
+    async def request_all_queries():
+        return await asyncio.gather(*[request(query, **request_args) for query in queries])
+    return run(request_all_queries())
@@ -2,6 +2,9 @@
 
 import argparse
 import sys,subprocess,os
+import time,signal,resource,tempfile
+import hashlib,json,csv,threading
+import concurrent.futures
 
 # This script is used to run a command-line program in every folder in a
 # given folder. This script takes a command and target parent directory for the
@@ -24,43 +27,550 @@ parser.add_argument("parent_dir", help="The given command will be run on each fo
 parser.add_argument("command", help="Command or path to program to run inside X.")
 parser.add_argument("--pass-name", action='store_true', help="If specified, the directory name X will be passed to the command as an argument.")
 parser.add_argument("--headers", action='store_true', help="Prints a header containing X before running the command.")
+parser.add_argument("--jobs", type=int, default=1,
+                    help="Number of folders to run the command in at the same time. The output of each folder is printed " +
+                         "in one piece, in folder name order. Default is 1.")
+parser.add_argument("--timeout", type=float,
+                    help="Stop the command (and anything it started) if it runs longer than TIMEOUT seconds in a folder.")
+parser.add_argument("--summary", action='store_true',
+                    help="Print a table of every folder's exit code at the end. Always done with --jobs.")
+parser.add_argument("--cpu-limit", type=float, metavar='SECONDS',
+                    help="Stop a program the command runs once it has used SECONDS seconds of CPU time.")
+parser.add_argument("--memory-limit", type=float, metavar='MB',
+                    help="Don't let the command use more than MB megabytes of memory in a folder.")
+parser.add_argument("--process-limit", type=int, metavar='N',
+                    help="Don't let the command start more than N processes (or threads) at once.")
+parser.add_argument("--cgroup", metavar='CGROUP_DIR',
+                    help="A cgroup v2 directory you're allowed to write to. Each folder is run in its own cgroup " +
+                         "inside it, which makes --memory-limit and --process-limit apply to the whole command.")
+parser.add_argument("--cache", metavar='CACHE_DIR',
+                    help="Save each folder's output and exit code in CACHE_DIR, and reuse them instead of running the " +
+                         "command again if the folder's git repo hasn't changed since.")
+parser.add_argument("--cache-max-age", type=float, default=30, metavar='DAYS',
+                    help="Delete cached results older than DAYS days. Default is 30.")
+parser.add_argument("--cache-max-size", type=float, default=500, metavar='MB',
+                    help="Delete the oldest cached results when the cache is bigger than MB megabytes. Default is 500.")
+parser.add_argument("--results", metavar='FILE',
+                    help="Write one record per folder to FILE as each folder finishes: folder, exit code, seconds, " +
+                         "peak memory and the (shortened) stdout and stderr.")
+parser.add_argument("--results-format", choices=['json', 'csv'],
+                    help="Format of the --results file: newline-delimited JSON or CSV. Default is csv if FILE ends " +
+                         "in .csv, json otherwise.")
+parser.add_argument("--results-max-output", type=int, default=2000, metavar='CHARS',
+                    help="Keep only the last CHARS characters of stdout and stderr in the --results file. Default is 2000.")
 args = parser.parse_args()
 
 parent_dir = args.parent_dir
 command = args.command
 pass_name = args.pass_name
 headers = args.headers
+jobs = args.jobs
+timeout = args.timeout
+summary = args.summary or jobs > 1
+cache_dir = args.cache
+results_format = args.results_format or ('csv' if args.results and args.results.lower().endswith('.csv') else 'json')
+# Output has to be captured to be saved in the cache, in the results file,
+# or to print each folder's output in one piece with --jobs
+capture = jobs > 1 or bool(cache_dir) or bool(args.results)
+limited = args.cpu_limit is not None or args.memory_limit is not None or args.process_limit is not None or \
+    bool(args.cgroup)
+if args.process_limit is not None and not args.cgroup and os.geteuid() == 0:
+    print("Warning: --process-limit has no effect when running as root without --cgroup")
+if cache_dir:
+    os.makedirs(cache_dir, exist_ok=True)
 
 # for debugging
 # print("parent_dir=" + str(parent_dir))
 # print("command=" + str(command))
 # print("pass_name=" + str(pass_name))
 
-# Navigate into parent_dir
+# Make sure parent_dir can be used
 try:
-    os.chdir(parent_dir)
+    items = sorted(os.listdir(parent_dir))
 except Exception as e:
     print("Could not navigate to directory %s" % parent_dir)
     print("Error message: %s" % str(e))
     sys.exit(1)
 
-# Loop over each directory in parent_dir (where we're at now)
-looped_once = False
-for item in os.listdir(os.getcwd()):
-    # Skip files
-    if not os.path.isdir(item):
-        continue
+# Skip files, and hidden folders like the reference repository
+# that clone.py --reference makes
+folders = [item for item in items
+           if os.path.isdir(os.path.join(parent_dir, item)) and not item.startswith('.')]
 
-    os.chdir(item)
+# The command that's run in the folder item
+def folder_command(item):
+    return command + " " + item if pass_name else command
+
+#
+# For --cache. A result is saved in CACHE_DIR under a key made from the
+# command, the folder name and the state of the folder's git repo: the tree
+# of the checked out commit plus the contents of any changes to tracked
+# files (git diff HEAD), so editing a file that was already changed makes a
+# new key. Untracked files (like build output) don't change the key. If the key is the same
+# next time, the saved result is printed instead of running the command.
+#
+
+# Returns the cache key for item, or None if item isn't a git repo
+def cache_key(item):
+    folder = os.path.join(parent_dir, item)
+    # A folder that isn't a repo itself could be inside some other repo
+    top_level = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=folder, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if top_level.returncode != 0 or \
+            os.path.realpath(top_level.stdout.decode('utf-8', errors='replace').strip()) != os.path.realpath(folder):
+        return None
+    state = []
+    for git_cmd in [['git', 'rev-parse', 'HEAD^{tree}'],
+                    ['git', 'diff', 'HEAD', '--binary', '--no-ext-diff', '--no-textconv']]:
+        git_result = subprocess.run(git_cmd, cwd=folder, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if git_result.returncode != 0:
+            return None
+        state.append(hashlib.sha256(git_result.stdout).hexdigest())
+    key_data = json.dumps([folder_command(item), item] + state)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+def cache_path(key):
+    return os.path.join(cache_dir, key + '.json')
+
+# Returns the saved result for key, or None
+def cached_result(key):
+    try:
+        with open(cache_path(key), 'r') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Recently used results are the last ones to be deleted by evict_cache
+    os.utime(cache_path(key))
+    result['cached'] = True
+    return result
+
+def save_result(key, result):
+    with open(cache_path(key) + '.tmp', 'w') as f:
+        json.dump(result, f)
+    os.replace(cache_path(key) + '.tmp', cache_path(key))
+
+# Deletes cached results that haven't been used for longer than --cache-max-age, then the
+# oldest ones until the cache is smaller than --cache-max-size.
+def evict_cache():
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.json'):
+            path = os.path.join(cache_dir, name)
+            entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+    entries.sort()
+    total_size = sum(size for mtime, size, path in entries)
+    oldest_allowed = time.time() - args.cache_max_age * 24 * 60 * 60
+    for mtime, size, path in entries:
+        if mtime >= oldest_allowed and total_size <= args.cache_max_size * 1024 * 1024:
+            break
+        os.remove(path)
+        total_size -= size
+
+# Same as run_in_folder, but uses and fills the cache when --cache is given
+def run_or_replay(item, capture):
+    if not cache_dir:
+        return run_in_folder(item, capture)
+    key = cache_key(item)
+    result = cached_result(key) if key else None
+    if result is None:
+        result = run_in_folder(item, capture)
+        # Results that depended on a time or resource limit aren't saved
+        if key and not result['timed_out'] and not result.get('limit_exceeded'):
+            try:
+                save_result(key, result)
+            except OSError as e:
+                print("Warning: could not save the result for %s in the cache: %s" % (item, e))
+    return result
+
+# Same as run_or_replay, but if the command can't be run at all (ex. the
+# folder can't be read), the error is returned as a failed result instead
+# of stopping the whole batch. The result's 'error' is the error message.
+def run_safely(item, capture):
+    try:
+        return run_or_replay(item, capture)
+    except Exception as e:
+        message = "%s: %s" % (type(e).__name__, e)
+        return {'folder': item, 'returncode': None, 'timed_out': False, 'output': '', 'errors': message + '\n',
+                'seconds': 0.0, 'peak_rss_kb': None, 'limit_exceeded': None, 'cached': False, 'error': message}
+
+#
+# For --cpu-limit, --memory-limit, --process-limit and --cgroup. The
+# command is started through a small Python program that sets the limits
+# on itself (and joins the folder's cgroup) and then runs the command with
+# /bin/sh, so the limits are inherited by everything the command runs.
+#
+# Without --cgroup, the limits are rlimits:
+#   --cpu-limit: RLIMIT_CPU, CPU time for each process the command runs
+#   --memory-limit: RLIMIT_AS, address space for each process
+#   --process-limit: RLIMIT_NPROC, which counts all the processes of the
+#                    user running this script, not just this folder's
+# With --cgroup, --memory-limit and --process-limit are set on the folder's
+# cgroup instead (memory.max and pids.max), so they count everything the
+# command runs together. --cpu-limit is always an rlimit.
+#
+
+limits_program = r'''
+import json,os,resource,sys
+limits = json.loads(sys.argv[1])
+for name, soft, hard in limits["rlimits"]:
+    resource.setrlimit(getattr(resource, name), (soft, hard))
+if limits["cgroup"]:
+    with open(os.path.join(limits["cgroup"], "cgroup.procs"), "w") as f:
+        f.write(str(os.getpid()))
+os.execv("/bin/sh", ["/bin/sh", "-c", sys.argv[2]])
+'''
+
+# What programs usually print when they can't get more memory or processes.
+# Without --cgroup, this is the only way to tell that a limit was the reason
+# a command failed (and only when its output is captured).
+memory_limit_messages = ['MemoryError', 'std::bad_alloc', 'java.lang.OutOfMemoryError', 'Cannot allocate memory',
+                         'insufficient memory', 'out of memory']
+process_limit_messages = ['Resource temporarily unavailable', 'unable to create native thread',
+                          'unable to create new native thread', "can't start new thread"]
+
+# Returns the rlimits for limits_program, as (name, soft limit, hard limit)
+# Input: job_cgroup: the folder's cgroup, or None. Without one, the memory
+#        and process limits are rlimits too.
+def rlimits(job_cgroup):
+    limits = []
+    if args.cpu_limit is not None:
+        # The soft limit sends SIGXCPU, the hard limit a second later SIGKILL
+        cpu_seconds = max(1, int(args.cpu_limit + 0.5))
+        limits.append(('RLIMIT_CPU', cpu_seconds, cpu_seconds + 1))
+    if args.memory_limit is not None and not job_cgroup:
+        memory_bytes = int(args.memory_limit * 1024 * 1024)
+        limits.append(('RLIMIT_AS', memory_bytes, memory_bytes))
+    if args.process_limit is not None and not job_cgroup:
+        limits.append(('RLIMIT_NPROC', args.process_limit, args.process_limit))
+    return limits
+
+# Makes a new cgroup inside --cgroup for one folder, with the memory and
+# process limits set. Returns its path, or None if it couldn't be made (ex.
+# a controller isn't enabled, so its files are missing). Then the folder
+# gets rlimits instead, and the other folders still run.
+def make_job_cgroup(item):
+    try:
+        job_cgroup = tempfile.mkdtemp(prefix='batch-', dir=args.cgroup)
+    except OSError as e:
+        print("Warning: could not make a cgroup for %s, using rlimits instead: %s" % (item, e))
+        return None
+    settings = []
+    if args.memory_limit is not None:
+        settings.append(('memory.max', int(args.memory_limit * 1024 * 1024)))
+        # Don't let the command get around the limit by swapping
+        settings.append(('memory.swap.max', 0))
+    if args.process_limit is not None:
+        settings.append(('pids.max', args.process_limit))
+    try:
+        for name, value in settings:
+            if name == 'memory.swap.max' and not os.path.exists(os.path.join(job_cgroup, name)):
+                continue
+            with open(os.path.join(job_cgroup, name), 'w') as f:
+                f.write(str(value))
+    except OSError as e:
+        print("Warning: could not set the limits of the cgroup for %s, using rlimits instead: %s" % (item, e))
+        remove_job_cgroup(job_cgroup)
+        return None
+    return job_cgroup
+
+# Returns the count for key in a cgroup events file, like memory.events
+def cgroup_event_count(job_cgroup, file_name, key):
+    try:
+        with open(os.path.join(job_cgroup, file_name), 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2 and fields[0] == key:
+                    return int(fields[1])
+    except OSError:
+        pass
+    return 0
+
+# Stops anything still running in the folder's cgroup, then removes it
+def remove_job_cgroup(job_cgroup):
+    kill_file = os.path.join(job_cgroup, 'cgroup.kill')
+    try:
+        if os.path.exists(kill_file):
+            with open(kill_file, 'w') as f:
+                f.write('1')
+    except OSError:
+        pass
+    for attempt in range(50):
+        try:
+            os.rmdir(job_cgroup)
+            return
+        except OSError:
+            # The killed processes haven't all exited yet
+            time.sleep(0.1)
+    print("Warning: could not remove cgroup %s" % job_cgroup)
+
+# Returns the most memory the command used at once, in kilobytes, or None
+# if it can't be told.
+# With a cgroup, this is its memory.peak (Linux 5.19 and up): everything the
+# command ran, together, and nothing else.
+# Otherwise it's ru_maxrss from os.wait4, the resident set size of the
+# biggest process. The kernel counts the memory of the process a command
+# was started from in it (this script, or the Python program that sets the
+# limits), so a command that used less than that can't be told apart from
+# one that used nothing. Then None is returned.
+def peak_memory_kb(rusage, job_cgroup):
+    if job_cgroup:
+        try:
+            with open(os.path.join(job_cgroup, 'memory.peak'), 'r') as f:
+                return int(f.read().strip()) // 1024
+        except (OSError, ValueError):
+            pass
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    scale = 1024 if sys.platform == 'darwin' else 1
+    launcher_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    peak_kb = rusage.ru_maxrss // scale
+    return peak_kb if peak_kb > launcher_kb else None
+
+# Returns which limit the command went over ('cpu', 'memory' or
+# 'process'), or None if it didn't (or it can't be told).
+# Input: status, rusage: from os.wait4
+#        errors: the captured stderr, or ''
+#        job_cgroup: the folder's cgroup, or None
+def limit_exceeded(status, rusage, errors, job_cgroup):
+    if args.cpu_limit is not None:
+        signal_number = os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+        # The shell exits with 128 + the signal number when a program it ran was killed
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) > 128:
+            signal_number = os.WEXITSTATUS(status) - 128
+        cpu_seconds = rusage.ru_utime + rusage.ru_stime
+        if signal_number == signal.SIGXCPU or \
+                (signal_number == signal.SIGKILL and cpu_seconds >= max(1, int(args.cpu_limit + 0.5))):
+            return 'cpu'
+    if job_cgroup:
+        if args.memory_limit is not None and cgroup_event_count(job_cgroup, 'memory.events', 'oom_kill') > 0:
+            return 'memory'
+        if args.process_limit is not None and cgroup_event_count(job_cgroup, 'pids.events', 'max') > 0:
+            return 'process'
+    if status != 0:
+        if args.memory_limit is not None and any(message in errors for message in memory_limit_messages):
+            return 'memory'
+        if args.process_limit is not None and any(message in errors for message in process_limit_messages):
+            return 'process'
+    return None
+
+# Runs the command in the folder item (inside parent_dir).
+# Input: item: the folder name
+#        capture: if True, the command's output is saved in the result instead
+#                 of going straight to the terminal
+# Returns: A hash with the keys:
+#   folder: A string, item
+#   returncode: An integer, the command's exit code, or None if it timed out
+#   timed_out: True if the command was stopped because of --timeout
+#   output, errors: Strings, the command's stdout and stderr ('' if not captured)
+#   seconds: A float, how long the command ran
+#   peak_rss_kb: An integer, the most memory used at once by the command or
+#                any program it ran, in kilobytes (see peak_memory_kb), or
+#                None if it can't be told
+#   limit_exceeded: 'cpu', 'memory' or 'process' if the command went over
+#                   that limit, otherwise None
+def run_in_folder(item, capture):
+    pipe = subprocess.PIPE if capture else None
+    job_cgroup = make_job_cgroup(item) if args.cgroup else None
+    if limited:
+        limits = {'rlimits': rlimits(job_cgroup), 'cgroup': job_cgroup}
+        popen_command = [sys.executable, '-c', limits_program, json.dumps(limits), folder_command(item)]
+    else:
+        popen_command = folder_command(item)
+    start = time.time()
+    # With a timeout, the command gets its own process group so that
+    # everything it started can be stopped together.
+    process = subprocess.Popen(popen_command, shell=not limited, cwd=os.path.join(parent_dir, item),
+                               stdin=subprocess.DEVNULL if capture else None,
+                               stdout=pipe, stderr=pipe, start_new_session=timeout is not None)
+
+    # The output is read by threads so that the command is waited for with
+    # os.wait4 here, which also gives its peak memory use.
+    captured = {}
+    readers = []
+    if capture:
+        for name, stream in [('output', process.stdout), ('errors', process.stderr)]:
+            reader = threading.Thread(target=lambda name=name, stream=stream: captured.update({name: stream.read()}))
+            reader.start()
+            readers.append(reader)
+    timed_out = threading.Event()
+    timer = None
+    if timeout is not None:
+        def stop_command():
+            timed_out.set()
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        timer = threading.Timer(timeout, stop_command)
+        timer.start()
+
+    pid, status, rusage = os.wait4(process.pid, 0)
+    if timer:
+        timer.cancel()
+    if timed_out.is_set():
+        # Kill anything the command left behind that's still writing to the pipes
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    for reader in readers:
+        reader.join()
+    # Let Popen know the command is done, since it was waited for here
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    if capture:
+        process.stdout.close()
+        process.stderr.close()
+
+    seconds = time.time() - start
+    output = (captured.get('output') or b'').decode('utf-8', errors='replace')
+    errors = (captured.get('errors') or b'').decode('utf-8', errors='replace')
+    exceeded = None
+    if limited and not timed_out.is_set():
+        exceeded = limit_exceeded(status, rusage, errors, job_cgroup)
+    peak_rss_kb = peak_memory_kb(rusage, job_cgroup)
+    if job_cgroup:
+        remove_job_cgroup(job_cgroup)
+
+    return {'folder': item,
+            'returncode': None if timed_out.is_set() else process.returncode,
+            'timed_out': timed_out.is_set(),
+            'output': output,
+            'errors': errors,
+            'seconds': seconds,
+            'peak_rss_kb': peak_rss_kb,
+            'limit_exceeded': exceeded,
+            'cached': False}
+
+#
+# For --results. One record per folder is added to the results file as
+# soon as the folder is done, so other programs can read it while the
+# batch is still running.
+#
+
+results_fields = ['folder', 'exit_code', 'timed_out', 'limit_exceeded', 'cached', 'seconds', 'peak_rss_kb',
+                  'stdout', 'stderr']
+results_file = None
+results_writer = None
+
+def open_results_file():
+    global results_file, results_writer
+    results_file = open(args.results, 'w', newline='')
+    if results_format == 'csv':
+        results_writer = csv.DictWriter(results_file, fieldnames=results_fields)
+        results_writer.writeheader()
+        results_file.flush()
+
+# Output longer than --results-max-output characters is cut off, keeping the end
+# (where errors and test totals usually are).
+def truncate(text):
+    if len(text) <= args.results_max_output:
+        return text
+    return "[...]" + text[len(text) - args.results_max_output:]
+
+def write_result_record(result):
+    record = {'folder': result['folder'],
+              'exit_code': result['returncode'],
+              'timed_out': result['timed_out'],
+              'limit_exceeded': result.get('limit_exceeded'),
+              'cached': result['cached'],
+              'seconds': round(result['seconds'], 3),
+              'peak_rss_kb': result.get('peak_rss_kb'),
+              'stdout': truncate(result['output']),
+              'stderr': truncate(result['errors'])}
+    if results_format == 'csv':
+        results_writer.writerow(record)
+    else:
+        results_file.write(json.dumps(record) + '\n')
+    results_file.flush()
+
+def print_header(item, first):
     if headers:
-        if looped_once:
+        if not first:
             print()
-        print(">>> Running command in %s" % os.path.abspath(item))
+        print(">>> Running command in %s" % os.path.abspath(os.path.join(parent_dir, item)))
 
-    # Execute given command
-    if pass_name:
-        subprocess.call(command + " " + item, shell=True)
-    else:
-        subprocess.call(command, shell=True)
-    os.chdir(os.pardir)
-    looped_once = True
+def print_limit_exceeded(result):
+    if result.get('limit_exceeded'):
+        print(">>> Command went over the %s limit in %s" % (result['limit_exceeded'], result['folder']))
+
+# Prints a captured result, under its header
+def print_result(result, first):
+    print_header(result['folder'], first)
+    if result['output']:
+        sys.stdout.write(result['output'])
+    if result['errors']:
+        sys.stdout.write(result['errors'])
+    if result['timed_out']:
+        print(">>> Command timed out after %s seconds in %s" % (timeout, result['folder']))
+    print_limit_exceeded(result)
+    if result.get('error'):
+        print(">>> Could not run the command in %s" % result['folder'])
+    if result['cached']:
+        print(">>> (saved result, %s hasn't changed)" % result['folder'])
+    sys.stdout.flush()
+
+# Loop over each directory in parent_dir
+if args.results:
+    open_results_file()
+results = []
+if jobs <= 1 and capture:
+    for i, item in enumerate(folders):
+        result = run_safely(item, capture=True)
+        if results_file:
+            write_result_record(result)
+        print_result(result, i == 0)
+        results.append(result)
+elif jobs <= 1:
+    for i, item in enumerate(folders):
+        print_header(item, i == 0)
+        sys.stdout.flush()
+        result = run_safely(item, capture=False)
+        if result['timed_out']:
+            print(">>> Command timed out after %s seconds in %s" % (timeout, item))
+        print_limit_exceeded(result)
+        if result.get('error'):
+            print(">>> Could not run the command in %s: %s" % (item, result['error']))
+        results.append(result)
+else:
+    # Records are written to the results file as soon as each folder is
+    # done. The output is printed in folder order, as soon as all the
+    # folders before it are done.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        # future -> the folder's place in folders
+        futures = dict((executor.submit(run_safely, item, True), i) for i, item in enumerate(folders))
+        finished = {}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if results_file:
+                write_result_record(result)
+            finished[futures[future]] = result
+            while len(results) in finished:
+                print_result(finished[len(results)], len(results) == 0)
+                results.append(finished.pop(len(results)))
+
+if results_file:
+    results_file.close()
+
+if summary and results:
+    print()
+    print("Summary:")
+    name_width = max([len(result['folder']) for result in results] + [len("Folder")])
+    print("\t%s   Exit code         Seconds" % "Folder".ljust(name_width))
+    print("\t%s   ---------------   -------" % ("-" * name_width))
+    for result in results:
+        if result['timed_out']:
+            exit_code = "timed out"
+        elif result.get('error'):
+            exit_code = "could not run"
+        elif result.get('limit_exceeded'):
+            exit_code = "%s limit" % result['limit_exceeded']
+        else:
+            exit_code = str(result['returncode'])
+        if result['cached']:
+            exit_code += " (saved)"
+        print("\t%s   %s   %7.1f" % (result['folder'].ljust(name_width), exit_code.ljust(15), result['seconds']))
+    failed = [result for result in results if result['returncode'] != 0]
+    print("%d of %d folders succeeded." % (len(results) - len(failed), len(results)))
+
+if cache_dir:
+    evict_cache()
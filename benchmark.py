@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys,subprocess,os
+import json,shutil,tempfile
+import time,datetime
+import mock_gitlab
+
+# This script times the other scripts against a mock Gitlab server (see
+# mock_gitlab.py), so changes to them can be measured without the real
+# server. For each class size, it makes a fake class list and runs, in order:
+#   create-users.py, create-class.py --add-students,
+#   create-repos.py --add-students, clone.py --revert-date
+# against a new, empty mock server.
+
+# Pre-conditions:
+#   - python-gitlab and git are installed
+
+# Post-conditions:
+#   - For each script and class size, the wall time, CPU time, peak memory
+#     and number of API requests have been printed and added to the results file
+#   - If the results file has a run with the same settings from before, the
+#     change since then has been printed
+
+
+parser = argparse.ArgumentParser(description="Times the scripts against a mock Gitlab server.")
+parser.add_argument('--sizes', default='50,500,5000',
+                    help="Comma separated class sizes (number of students) to run with. Default is 50,500,5000.")
+parser.add_argument('--jobs', type=int, default=8,
+                    help="Passed to create-repos.py and clone.py as --jobs. Default is 8.")
+parser.add_argument('--rate', type=float,
+                    help="Passed to create-repos.py as --rate. Default is to use the value in config.py.")
+parser.add_argument('--latency', type=float, default=0.01,
+                    help="Seconds the mock server waits before answering each API request. Default is 0.01.")
+parser.add_argument('--jitter', type=float, default=0,
+                    help="Up to this many more seconds are waited, at random. Default is 0.")
+parser.add_argument('--error-rate', type=float, default=0,
+                    help="Fraction of API requests (0 to 1) the mock server answers with an error. Default is 0.")
+parser.add_argument('--error-status', type=int, default=500,
+                    help="HTTP status of the --error-rate errors. Default is 500.")
+parser.add_argument('--output', default='benchmark-results.jsonl',
+                    help="File to add the results to, one JSON object per line. Default is benchmark-results.jsonl.")
+parser.add_argument('--label', default='',
+                    help="A note saved with the results, ex. 'before connection pool'.")
+parser.add_argument('--work-dir',
+                    help="Folder for the class lists, the mock server's repos and the clones. Default is a temporary " +
+                         "folder that's deleted at the end.")
+args = parser.parse_args()
+
+sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+script_dir = os.path.dirname(os.path.abspath(__file__))
+course_number = '408'
+course_section = '1'
+group_name = 'csci-%s-%s' % (course_number, course_section)
+
+# The settings that have to be the same for two runs to be compared
+comparison_keys = ['script', 'students', 'jobs', 'rate', 'latency', 'jitter', 'error_rate', 'error_status']
+
+# Usernames look like the real ones (2 letters and 6 digits) so that
+# create-repos.py --classlist finds them
+def student_username(i):
+    return chr(ord('a') + i % 26) + chr(ord('a') + i // 26 % 26) + '%06d' % i
+
+# Writes a class list in the format create-users.py and create-class.py read
+def write_roster(path, size):
+    with open(path, 'w') as f:
+        for i in range(size):
+            f.write("CSCI,%s,%s,SOFTWARE ENGINEERING,@%08d,Last%d,First%d,5-Oct-97,%s@scots.edinboro.edu\n" %
+                    (course_number, course_section, i, i, i, student_username(i)))
+
+# Returns the commit the scripts are at, with '+' added if they have changes
+def scripts_version():
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=script_dir,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode('utf-8').strip()
+    changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=script_dir,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode('utf-8').strip()
+    return commit + ('+' if changes else '') if commit else None
+
+# Runs one of the scripts and measures it. Its output goes to log_path.
+# Returns: A hash with the keys exit_code, seconds, cpu_seconds and peak_rss_kb
+def run_script(script, script_args, work_dir, env, log_path):
+    with open(log_path, 'w') as log:
+        start = time.time()
+        process = subprocess.Popen([sys.executable, os.path.join(script_dir, script + '.py')] + script_args,
+                                   cwd=work_dir, env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        pid, status, rusage = os.wait4(process.pid, 0)
+        seconds = time.time() - start
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peak_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return {'exit_code': process.returncode,
+            'seconds': round(seconds, 3),
+            'cpu_seconds': round(rusage.ru_utime + rusage.ru_stime, 3),
+            'peak_rss_kb': peak_rss_kb}
+
+# Returns how much of a script's work is done, as (number done, number expected),
+# by looking at the mock server (or the clones)
+def work_done(script, gitlab, work_dir, size):
+    usernames = set(student_username(i) for i in range(size))
+    if script == 'create-users':
+        done = [user for user in gitlab.users.values() if user['username'] in usernames]
+    elif script == 'create-class':
+        groups = [group for group in gitlab.groups.values() if group['path'] == group_name]
+        done = list(gitlab.members[('groups', groups[0]['id'])]) if groups else []
+    elif script == 'create-repos':
+        done = [project for project in gitlab.projects.values()
+                if 'master' in gitlab.branches[project['id']] and gitlab.members[('projects', project['id'])]]
+    else:
+        clone_dir = os.path.join(work_dir, 'clones')
+        done = [name for name in usernames if os.path.isdir(os.path.join(clone_dir, name, '.git'))]
+    return len(done), size
+
+# Runs all the scripts for a class of size students.
+# Returns: A list of result records, one per script
+def run_class(size, work_root):
+    work_dir = os.path.join(work_root, 'students-%d' % size)
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+    gitlab = mock_gitlab.MockGitlab(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                    error_status=args.error_status, repo_dir=os.path.join(work_dir, 'repos'))
+    server = mock_gitlab.start_server(gitlab)
+    env = dict(os.environ, GITLAB_URL='http://127.0.0.1:%d' % server.server_address[1])
+
+    write_roster(os.path.join(work_dir, 'roster.csv'), size)
+    with open(os.path.join(work_dir, 'classlist.txt'), 'w') as f:
+        f.write(''.join(student_username(i) + '\n' for i in range(size)))
+    with open(os.path.join(work_dir, 'test_token'), 'w') as f:
+        f.write('benchmark-token\n')
+
+    jobs_args = ['--jobs', str(args.jobs)]
+    rate_args = ['--rate', str(args.rate)] if args.rate is not None else []
+    tomorrow = (datetime.datetime.now() + datetime.timedelta(days=1)).strftime('%Y-%m-%d %H:%M')
+    steps = [('create-users', ['--file-name', 'roster.csv', '--course-number', course_number,
+                               '--course-section', course_section]),
+             ('create-class', ['--course-name', 'CSCI' + course_number, '--course-section', course_section,
+                               '--add-students', '--file-name', 'roster.csv']),
+             ('create-repos', [group_name, '--token-file', 'test_token', '--classlist', 'classlist.txt',
+                               '--add-students'] + jobs_args + rate_args),
+             ('clone', [group_name, '--token-file', 'test_token', '--url-type', 'ssh', '--clone-dir', 'clones',
+                        '--revert-date', tomorrow] + jobs_args)]
+
+    records = []
+    try:
+        for script, script_args in steps:
+            print("Running %s.py for %d students..." % (script, size), flush=True)
+            gitlab.take_request_counts()
+            errors_before = gitlab.errors_sent
+            result = run_script(script, script_args, work_dir, env, os.path.join(work_dir, script + '.log'))
+            request_counts = gitlab.take_request_counts()
+            done, expected = work_done(script, gitlab, work_dir, size)
+            record = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                      'version': scripts_version(),
+                      'label': args.label,
+                      'script': script,
+                      'students': size,
+                      'jobs': args.jobs,
+                      'rate': args.rate,
+                      'latency': args.latency,
+                      'jitter': args.jitter,
+                      'error_rate': args.error_rate,
+                      'error_status': args.error_status,
+                      'requests': sum(request_counts.values()),
+                      'requests_by_route': request_counts,
+                      'errors_sent': gitlab.errors_sent - errors_before,
+                      'done': done,
+                      'expected': expected}
+            record.update(result)
+            records.append(record)
+            if result['exit_code'] != 0 or done < expected:
+                print("  %s.py exited with %d and did %d of %d. See %s" %
+                      (script, result['exit_code'], done, expected, os.path.join(work_dir, script + '.log')))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return records
+
+# Returns the most recent record in old_records with the same settings as record, or None
+def previous_record(record, old_records):
+    for old_record in reversed(old_records):
+        if all(old_record.get(key) == record[key] for key in comparison_keys):
+            return old_record
+    return None
+
+def percent_change(new, old):
+    if not old:
+        return ''
+    return '%+.0f%%' % ((new - old) * 100.0 / old)
+
+def print_table(records, old_records):
+    print()
+    print("\t%-13s %8s %9s %7s %9s %7s %8s   %s" %
+          ("Script", "Students", "Seconds", "Change", "Requests", "Change", "Peak MB", "Result"))
+    print("\t%s %s %s %s %s %s %s   %s" % ('-' * 13, '-' * 8, '-' * 9, '-' * 7, '-' * 9, '-' * 7, '-' * 8, '-' * 15))
+    for record in records:
+        old_record = previous_record(record, old_records) or {}
+        if record['exit_code'] != 0:
+            outcome = "exit code %d" % record['exit_code']
+        elif record['done'] < record['expected']:
+            outcome = "only %d of %d" % (record['done'], record['expected'])
+        else:
+            outcome = "ok"
+        print("\t%-13s %8d %9.2f %7s %9d %7s %8.1f   %s" %
+              (record['script'], record['students'], record['seconds'],
+               percent_change(record['seconds'], old_record.get('seconds')),
+               record['requests'], percent_change(record['requests'], old_record.get('requests')),
+               record['peak_rss_kb'] / 1024.0, outcome))
+    if old_records:
+        print("Changes are since the last run in %s with the same settings." % args.output)
+
+old_records = []
+if os.path.exists(args.output):
+    with open(args.output, 'r') as f:
+        old_records = [json.loads(line) for line in f if line.strip()]
+
+work_root = args.work_dir or tempfile.mkdtemp(prefix='gitlab-benchmark-')
+records = []
+try:
+    for size in sizes:
+        size_records = run_class(size, os.path.abspath(work_root))
+        with open(args.output, 'a') as f:
+            for record in size_records:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+        records.extend(size_records)
+finally:
+    if not args.work_dir:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+print_table(records, old_records)
@@ -3,8 +3,9 @@
 import simple_gitlab
 import pprint # useful for debugging
 import argparse,getpass,re,time
-from datetime import datetime
-import sys,subprocess,os
+from datetime import datetime, timedelta
+import sys,subprocess,os,shutil
+import threading,concurrent.futures
 import json,urllib.request
 from config import host_url, host_url_just_fqdn
 
@@ -27,6 +28,16 @@ def valid_datetime(s):
             pass
     raise argparse.ArgumentTypeError("Could not parse %s." % s)
 
+# Gitlab has time in a format not easily read by Python's datetime,
+# so do a little formatting with regex. Returns a datetime object.
+# Example:
+# gitlab_time('2016-05-30T15:10:30.123-04:00')
+# => datetime for 2016-05-30 15:10:30-0400
+def gitlab_time(s):
+    s = re.sub('Z$', '+00:00', s)
+    s = re.sub('([\d]{2})\.[\d]{3}(.[\d]{2}):([\d]{2})', r"\1\2\3", s)
+    return datetime.strptime(s, "%Y-%m-%dT%H:%M:%S%z")
+
 # Given a http or ssh git URL, return the repository name
 # Example:
 # url2reponame('gitlab@codestore.cs.edinboro.edu:cs349-test1/johnsmith.git')
@@ -54,7 +65,32 @@ parser.add_argument('--revert-date', type=valid_datetime, help="Once cloned, rev
 parser.add_argument('--students', help="A comma separated list of student Quest IDs.  If given, only these student's repos will be cloned. " +
                                        "Default is to clone every project in the group.")
 parser.add_argument('--username', help="Username on codestore.cs.edinboro.edu (same as Quest ID).")
+parser.add_argument('--resolver', choices=['events', 'push-index', 'commit-date'], default='events',
+                    help="How --revert-date finds the on-time commit. events: look at each project's push events on " +
+                         "Gitlab. push-index: like events, but keep an index of the pushes in the clone directory so " +
+                         "only new pushes are read from Gitlab. commit-date: use commit dates in the clones, with no " +
+                         "API calls (commit dates can be faked). Default is events.")
+parser.add_argument('--sync', action='store_true',
+                    help="Fetch new commits into repos that were already cloned instead of skipping them. " +
+                         "Repos with no activity since the last --sync are not fetched at all.")
+parser.add_argument('--reference', nargs='?', const='', metavar='URL',
+                    help="Keep a reference repository in the clone directory and clone each repo against it, so the " +
+                         "history the repos share is only downloaded and stored once. If URL is given (ex. a starter code " +
+                         "repo), it's used to fill the reference repository. Default is to use the first student's repo.")
+parser.add_argument('--depth', type=int,
+                    help="Only clone the last DEPTH commits of master (a shallow clone). If --revert-date needs an " +
+                         "older commit, it's fetched when needed.")
+parser.add_argument('--filter', metavar='FILTER_SPEC',
+                    help="Passed to git clone --filter to make a partial clone, ex. blob:none. Files are downloaded " +
+                         "when they're checked out. Servers that don't support it send everything.")
+parser.add_argument('--ontime-only', action='store_true',
+                    help="With --revert-date, find the on-time commit first and fetch only that commit, " +
+                         "with no history. Falls back to a normal clone if the server won't allow it.")
+parser.add_argument('--jobs', type=int, default=1,
+                    help="Number of repos to clone (and revert) at the same time. Default is 1.")
+simple_gitlab.add_profile_argument(parser)
 args = parser.parse_args()
+simple_gitlab.profile_from_args(args)
 
 # save command line argument inputs in variables
 group_to_clone = args.group_name
@@ -98,11 +134,12 @@ print("Found group %s which has ID %d" % (group_to_clone, group_id))
 #   project_id: An integer, the project id
 #   http_url: A string, the repo http url
 #   ssh_url: A string, the repo ssh url
+#   last_activity_at: A string, when Gitlab last saw activity in the project
 #
 
 print("Getting git repo URLs in group %s (id %d)." % (group_to_clone, group_id))
 
-group_to_clone_data = simple_gitlab.request("groups/%d?per_page=10000" % group_id)
+group_to_clone_data = simple_gitlab.request("groups/%d?per_page=10000" % group_id, quit_on_error=True)
 projects_data = group_to_clone_data['projects']
 all_usernames = []
 urls = []
@@ -119,7 +156,8 @@ for project in projects_data:
         urls.append({'username': username,
                      'project_id': project['id'],
                      'http_url': http_url,
-                     'ssh_url': ssh_url})
+                     'ssh_url': ssh_url,
+                     'last_activity_at': project.get('last_activity_at')})
 urls.sort(key = lambda proj: proj['username'])
 
 # If the user uses --students command line option and gives an invalid
@@ -151,63 +189,446 @@ elif url_type == 'ssh-save':
     subprocess.call('ssh-agent')
     subprocess.call('ssh-add')
 
-# Loop over each student and clone
-students_without_revision = []
-print("Cloning projects to the folder %s." % clone_dir)
-if revert_date:
-    print("Also checking out latest commit from latest push before %s." % revert_date)
-for url_info in urls:
-    # Get the right type of url to use (http or ssh)
+#
+# Clone (and possibly revert) one student's repo. Used for both the
+# one-at-a-time and the --jobs N modes.
+#
+# In --jobs mode several repos are worked on at once, so the output of each
+# repo is collected in a list and printed in one piece when the repo is done.
+# With output=None, everything is printed right away like before.
+#
+
+print_lock = threading.Lock()
+
+# For --sync. The state file in clone_dir remembers, for each repo, the
+# project's last_activity_at and the head of master at the last sync. If
+# last_activity_at hasn't changed, nothing has been pushed and git isn't run.
+#
+# Gitlab only updates last_activity_at if it's older than an hour, so a push
+# within an hour of the last activity doesn't change it. A repo is only
+# skipped if the last sync happened at least that long after the last activity.
+sync_state_file = '.clone-sync.json'
+activity_update_interval = 60 * 60
+sync_state = {}
+state_lock = threading.Lock()
+
+# Reads a JSON state file in clone_dir. Returns {} if there isn't one yet.
+def load_state(state_file):
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print("Could not read %s, starting over. Error message: %s" % (state_file, str(e)))
+        return {}
+
+def save_state(state_file, state):
+    with state_lock:
+        with open(state_file + '.tmp', 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(state_file + '.tmp', state_file)
+
+# Returns True if the project in url_info hasn't had any activity since
+# the time saved in record (a hash with last_activity_at and synced_at).
+def unchanged_since(url_info, record):
+    if not record or not url_info['last_activity_at']:
+        return False
+    if record['last_activity_at'] != url_info['last_activity_at']:
+        return False
+    last_activity = gitlab_time(url_info['last_activity_at']).timestamp()
+    return record['synced_at'] - last_activity >= activity_update_interval
+
+# Remembers the current head of origin/master in username's clone
+def record_sync(url_info, username):
+    head = git_output(['git', 'rev-parse', '--verify', '-q', 'origin/master'], username)
+    with state_lock:
+        sync_state[username] = {'last_activity_at': url_info['last_activity_at'],
+                                'head': head,
+                                'synced_at': time.time()}
+
+# Adds msg to output, or prints it if output is None
+def report(output, msg):
+    if output is None:
+        print(msg)
+    else:
+        output.append(msg)
+
+# Runs cmd (a list) in the folder cwd and returns the exit code.
+# The command's output is captured into output unless output is None.
+def run_command(cmd, output, cwd=None):
+    if output is None:
+        return subprocess.call(cmd, cwd=cwd)
+    result = subprocess.run(cmd, cwd=cwd, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    if result.stdout:
+        output.append(result.stdout.rstrip())
+    return result.returncode
+
+# Runs cmd (a list) in the folder cwd and returns what it printed,
+# or None if it failed. Nothing is shown on the terminal.
+def git_output(cmd, cwd=None):
+    result = subprocess.run(cmd, cwd=cwd, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+# Brings an existing clone up to date with the master branch on Gitlab.
+# If a revision was checked out by an earlier --revert-date, master is
+# checked out again first.
+def sync_repo(url_info, username, output):
+    with state_lock:
+        last_sync = sync_state.get(username)
+    unchanged = unchanged_since(url_info, last_sync)
+    if unchanged and on_master_at(username, last_sync.get('head')):
+        report(output, "> No activity in %s since the last sync. Not fetching." % username)
+        return
+    if unchanged:
+        # Nothing new to fetch, but an earlier run (ex. --revert-date) left
+        # something other than master checked out
+        report(output, "> No activity in %s since the last sync. Checking out master." % username)
+    else:
+        report(output, "> Fetching new commits for %s." % username)
+        if run_command(['git', 'fetch', '--prune', 'origin'], output, cwd=username) != 0:
+            report(output, "> git fetch failed!")
+            return
+    if git_output(['git', 'rev-parse', '--verify', '-q', 'origin/master'], username) is not None:
+        if (run_command(['git', 'checkout', '-q', 'master'], output, cwd=username) != 0 or
+                run_command(['git', 'merge', '-q', '--ff-only', 'origin/master'], output, cwd=username) != 0):
+            report(output, "> Could not fast-forward master in %s." % username)
+            return
+    if not unchanged:
+        record_sync(url_info, username)
+
+# Returns True if username's clone has the master branch checked out, at head
+def on_master_at(username, head):
+    return (head is not None and
+            git_output(['git', 'symbolic-ref', '-q', 'HEAD'], username) == 'refs/heads/master' and
+            git_output(['git', 'rev-parse', '--verify', '-q', 'HEAD'], username) == head)
+
+# Returns the right type of url to use (http or ssh) for url_info
+def repo_url(url_info):
     if url_type == 'http' or url_type == 'http-save':
-        url = url_info['http_url']
+        return url_info['http_url']
     elif url_type == 'ssh' or url_type == 'ssh-save':
-        url = url_info['ssh_url']
+        return url_info['ssh_url']
+
+# For --reference. The reference repository is a bare repo in clone_dir that
+# the student repos are cloned against (see git clone --reference). Objects
+# that are already in it, like starter code history the repos were all made
+# from, are not downloaded again, and the clones borrow them instead of
+# keeping their own copy. (The first commit create-repos.py makes is made
+# separately in each repo, so it's a different commit in each and isn't
+# shared.) The clones need the reference repository, so
+# don't delete it while you still need the clones.
+reference_repo = os.path.abspath('.reference.git')
 
+# Creates the reference repository if needed and fetches the branches
+# of the repos in seed_urls into it.
+# Input: seed_urls: a list of (name, url) pairs. The branches of url are
+#                   stored under refs/remotes/name/ in the reference repository.
+def update_reference_repo(seed_urls):
+    if not os.path.isdir(reference_repo):
+        print("Creating reference repository %s." % reference_repo)
+        subprocess.call(['git', 'init', '-q', '--bare', reference_repo])
+    for name, url in seed_urls:
+        print("Fetching %s into the reference repository." % url)
+        subprocess.call(['git', '--git-dir', reference_repo, 'fetch', '-q', '--prune', url,
+                         '+refs/heads/*:refs/remotes/%s/*' % name])
+
+# Input: url_info: one of the hashes in urls
+#        output: a list to collect output in, or None to print it directly
+# Returns: True if the student has a revision checked out (or no
+#          revert_date was given), False if they should be reported in
+#          students_without_revision.
+def process_repo(url_info, output=None):
+    url = repo_url(url_info)
     username = url2reponame(url)
 
-    print(os.linesep)
-    print('-' * 60)
-    if os.path.isdir(username) and os.listdir(username):
-        print("> Destination folder %s already exists and is not empty." % username)
-        print("> Not cloning %s." % url)
+    report(output, os.linesep)
+    report(output, '-' * 60)
+    already_cloned = os.path.isdir(username) and os.listdir(username)
+
+    # With --ontime-only, find the on-time commit first so that only
+    # that commit has to be fetched.
+    ontime_push_time = None
+    ontime_commit    = None
+    if revert_date and ontime_only and not already_cloned:
+        ontime_push_time, ontime_commit = find_ontime_commit(url_info)
+        if ontime_push_time:
+            report(output, "> Using commit %s from the %s dated %s." % (ontime_commit, ontime_source, ontime_push_time))
+            if fetch_ontime_commit(url, username, ontime_commit, output):
+                return True
+
+    if already_cloned:
+        if sync:
+            sync_repo(url_info, username, output)
+        else:
+            report(output, "> Destination folder %s already exists and is not empty." % username)
+            report(output, "> Not cloning %s." % url)
     else:
-        print("> Cloning " + url)
-        subprocess.call(['git', 'clone', url])
+        report(output, "> Cloning " + url)
+        if clone_repo(url, output) and sync:
+            record_sync(url_info, username)
 
     # Checkout the latest commit from the latest push that was made before
     # the given date.
-    if revert_date:
-        # Find the latest push that's on or before revert_date
-        ontime_push_time = None
-        ontime_commit    = None
-        project_events = simple_gitlab.request('projects/%s/events?per_page=10000000' % url_info['project_id'])
-        for event in project_events:
-            # Only care about project events that are pushes to master branch
+    if not revert_date:
+        return True
+
+    if not ontime_push_time:
+        ontime_push_time, ontime_commit = find_ontime_commit(url_info)
+        if not ontime_push_time:
+            report(output, "> Could not find any %ss to master branch before %s." % (ontime_source, revert_date))
+            return False
+        report(output, "> Using commit %s from the %s dated %s." % (ontime_commit, ontime_source, ontime_push_time))
+
+    report(output, "> Checking out commit %s." % ontime_commit)
+    if not os.path.isdir(username):
+        report(output, "> Directory %s doesn't exist. Cannot run git checkout." % username)
+        return False
+    if run_command(['git', 'checkout', ontime_commit], output, cwd=username) == 0:
+        return True
+    if depth and fetch_missing_commit(username, ontime_commit, output):
+        if run_command(['git', 'checkout', ontime_commit], output, cwd=username) == 0:
+            return True
+    report(output, "> git checkout failed!")
+    return False
+
+# Finds the on-time commit for url_info with the chosen --resolver.
+# Returns (time, commit id), or (None, None) if there isn't one.
+def find_ontime_commit(url_info):
+    if resolver == 'push-index':
+        return find_indexed_push(url_info)
+    elif resolver == 'commit-date':
+        return find_commit_by_date(url_info['username'])
+    return find_ontime_push(url_info)
+
+# Find the latest push to master that's on or before revert_date, using
+# the project's events on Gitlab (--resolver events).
+# Gitlab lists events newest first, so the events are read one page at a
+# time and the search stops at the first push to master before revert_date.
+# The server is also asked to leave out events that aren't pushes or that
+# are well after revert_date. Servers that don't support those filters
+# ignore them, which is fine because every event is checked here anyway.
+# Returns (push time, commit id), or (None, None) if there wasn't one.
+def find_ontime_push(url_info):
+    before = (revert_date + timedelta(days=2)).strftime('%Y-%m-%d')
+    events_query = 'projects/%s/events?action=pushed&before=%s' % (url_info['project_id'], before)
+    for event in simple_gitlab.request_pages(events_query):
+        # Only care about project events that are pushes to master branch
+        if event['action_name'] in ['pushed to', 'pushed new'] and event['data']['ref'] == 'refs/heads/master':
+            created_at = gitlab_time(event['created_at'])
+            if created_at <= revert_date:
+                return created_at, event['data']['after']
+    return None, None
+
+# For --resolver push-index. The push index in clone_dir keeps the time
+# and commit of every push to master for each repo, newest first. Only the
+# events newer than the newest push in the index are read from Gitlab, and
+# a repo with no activity since it was last indexed isn't read at all. So
+# after the first run, checking out another deadline for the whole group
+# takes very few API calls.
+push_index_file = '.push-index.json'
+push_index = {}
+
+def find_indexed_push(url_info):
+    username = url_info['username']
+    with state_lock:
+        record = push_index.get(username)
+    if not unchanged_since(url_info, record):
+        record = update_push_index(url_info, record)
+    for push_time, commit in record['pushes']:
+        push_time = gitlab_time(push_time)
+        if push_time <= revert_date:
+            return push_time, commit
+    return None, None
+
+# Adds the pushes that aren't in record yet to the push index and
+# returns the new record for url_info. The record is only changed once all
+# the new events have been read. If a page of events can't be read, the old
+# record is kept (so the next run reads those events again) and the
+# simple_gitlab.PageRequestError is raised for the caller to report.
+def update_push_index(url_info, record):
+    known_pushes = record['pushes'] if record else []
+    newest_known = gitlab_time(known_pushes[0][0]) if known_pushes else None
+    new_pushes = []
+    synced_at = time.time()
+    events_query = 'projects/%s/events?action=pushed' % url_info['project_id']
+    try:
+        for event in simple_gitlab.request_pages(events_query):
             if event['action_name'] in ['pushed to', 'pushed new'] and event['data']['ref'] == 'refs/heads/master':
-                # Gitlab has time in a format not easily read by Python's datetime,
-                # so do a little formatting with regex.
-                created_at_py = re.sub('([\d]{2})\.[\d]{3}(.[\d]{2}):([\d]{2})', r"\1\2\3", event['created_at'])
-                created_at = datetime.strptime(created_at_py, "%Y-%m-%dT%H:%M:%S%z")
-                if created_at <= revert_date and (not ontime_push_time or created_at > ontime_push_time):
-                    ontime_push_time = created_at
-                    ontime_commit = event['data']['after']
-        if ontime_push_time:
-            print("> Using commit %s from the push dated %s." % (ontime_commit, ontime_push_time))
-            print("> Checking out commit %s." % ontime_commit)
-            if os.path.isdir(username):
-                os.chdir(username)
-                try:
-                    subprocess.call(['git', 'checkout', ontime_commit])
-                except Exception as e:
-                    print("> git checkout failed!")
-                    students_without_revision.append(username)
-                os.chdir(os.pardir)
-            else:
-                print("> Directory %s doesn't exist. Cannot run git checkout." % username)
-                students_without_revision.append(username)
-        else:
-            print("> Could not find any pushes to master branch before %s." % revert_date)
-            students_without_revision.append(username)
+                push = [event['created_at'], event['data']['after']]
+                if newest_known and gitlab_time(push[0]) <= newest_known:
+                    # Everything from here on is already in the index
+                    break
+                new_pushes.append(push)
+    except simple_gitlab.PageRequestError as e:
+        raise simple_gitlab.PageRequestError("%s. The push index for %s was not updated." %
+                                             (e, url_info['username']))
+    record = {'last_activity_at': url_info['last_activity_at'],
+              'synced_at': synced_at,
+              'pushes': new_pushes + [push for push in known_pushes if push not in new_pushes]}
+    with state_lock:
+        push_index[url_info['username']] = record
+    return record
+
+# For --resolver commit-date. Uses the commit dates in the clone instead of
+# push times, so no API calls are needed. Commit dates come from the
+# student's computer and can be wrong or faked (see Caveats in the README).
+# Finds the newest commit on master, following first parents only, whose
+# committer date is on or before revert_date.
+def find_commit_by_date(username):
+    if not os.path.isdir(username):
+        return None, None
+    for branch in ['origin/master', 'master', 'HEAD']:
+        if git_output(['git', 'rev-parse', '--verify', '-q', branch], username) is not None:
+            break
+    log_cmd = ['git', 'log', '-1', '--first-parent', '--format=%H %cd', '--date=iso-strict',
+               '--before=%s' % revert_date.isoformat(), branch]
+    found = git_output(log_cmd, username)
+    if not found and git_output(['git', 'rev-parse', '--is-shallow-repository'], username) == 'true':
+        git_output(['git', 'fetch', '-q', '--unshallow', 'origin'], username)
+        found = git_output(log_cmd, username)
+    if not found:
+        return None, None
+    commit, commit_date = found.split(' ', 1)
+    return commit_date, commit
+
+# Returns the version of git as a tuple of numbers, ex. (2, 39, 5), or
+# () if it can't be told
+def git_version():
+    found = re.search(r'(\d+(?:\.\d+)*)', git_output(['git', '--version']) or '')
+    return tuple(int(part) for part in found.group(1).split('.')) if found else ()
+
+# Runs git clone with the --reference, --depth and --filter options
+# that were given. Returns True if the clone worked.
+def clone_repo(url, output):
+    clone_cmd = ['git', 'clone']
+    if reference is not None and reference_option:
+        clone_cmd += [reference_option, reference_repo]
+    if depth:
+        clone_cmd += ['--depth', str(depth)]
+    if clone_filter:
+        clone_cmd += ['--filter', clone_filter]
+    return run_command(clone_cmd + [url], output) == 0
+
+# For --ontime-only. Makes an empty repo in username and fetches just
+# commit into it, without any history. Not every server lets you fetch a
+# commit by its id; if the fetch is refused, the folder is removed and
+# False is returned so that a normal clone can be done instead.
+def fetch_ontime_commit(url, username, commit, output):
+    report(output, "> Fetching only commit %s from %s" % (commit, url))
+    os.makedirs(username, exist_ok=True)
+    if (run_command(['git', 'init', '-q'], output, cwd=username) == 0 and
+            run_command(['git', 'remote', 'add', 'origin', url], output, cwd=username) == 0 and
+            run_command(['git', 'fetch', '-q', '--depth', '1', 'origin', commit], output, cwd=username) == 0 and
+            run_command(['git', 'checkout', '-q', commit], output, cwd=username) == 0):
+        return True
+    report(output, "> Could not fetch only commit %s. Doing a normal clone instead." % commit)
+    shutil.rmtree(username, ignore_errors=True)
+    return False
+
+# For --depth. The on-time commit can be older than the history in a
+# shallow clone. Fetches commit by itself, or the rest of the history if
+# the server won't allow that. Returns True if either fetch worked.
+def fetch_missing_commit(username, commit, output):
+    report(output, "> Commit %s isn't in the shallow clone. Fetching it." % commit)
+    if run_command(['git', 'fetch', '-q', '--depth', '1', 'origin', commit], output, cwd=username) == 0:
+        return True
+    return run_command(['git', 'fetch', '-q', '--unshallow', 'origin'], output, cwd=username) == 0
+
+# Runs process_repo. If anything goes wrong (ex. a page of events couldn't
+# be read from Gitlab), the error is reported and False is returned, so the
+# other repos are still done.
+def process_repo_safely(url_info, output=None):
+    try:
+        return process_repo(url_info, output)
+    except Exception as e:
+        report(output, "> Error %s message: %s" % (type(e).__name__, str(e)))
+        return False
+
+# Used by the worker pool. Runs process_repo and prints its output all at once.
+def process_repo_buffered(url_info):
+    output = []
+    has_revision = process_repo_safely(url_info, output)
+    with print_lock:
+        print(os.linesep.join(output), flush=True)
+    return has_revision
+
+# Loop over each student and clone
+students_without_revision = []
+print("Cloning projects to the folder %s." % clone_dir)
+if revert_date:
+    print("Also checking out latest commit from latest push before %s." % revert_date)
+
+sync = args.sync
+if sync:
+    sync_state = load_state(sync_state_file)
+
+resolver = args.resolver
+ontime_source = 'commit' if resolver == 'commit-date' else 'push'
+if resolver == 'push-index':
+    push_index = load_state(push_index_file)
+elif resolver == 'commit-date' and args.ontime_only:
+    print("--ontime-only can't be used with --resolver commit-date. Cloning normally.")
+    args.ontime_only = False
+
+depth = args.depth
+clone_filter = args.filter
+ontime_only = args.ontime_only
+if ontime_only and not revert_date:
+    print("--ontime-only needs --revert-date. Cloning normally.")
+
+reference = args.reference
+if reference is not None:
+    if reference:
+        update_reference_repo([('starter', reference)])
+    elif urls:
+        update_reference_repo([(urls[0]['username'], repo_url(urls[0]))])
+    # --reference-if-able (git 2.11 and up) clones without the reference
+    # repository if it couldn't be made. Older versions only have --reference,
+    # which fails the clone, so then it's only used if the repository is there.
+    if git_version() >= (2, 11):
+        reference_option = '--reference-if-able'
+    elif os.path.isdir(reference_repo):
+        reference_option = '--reference'
+    else:
+        print("Could not make the reference repository %s. Cloning without it." % reference_repo)
+        reference_option = None
+
+jobs = args.jobs
+if jobs > 1 and url_type == 'http':
+    # Every clone would ask for a password at the same time.
+    print("--jobs needs saved credentials (--url-type http-save, ssh or ssh-save). Cloning one at a time.")
+    jobs = 1
+
+if jobs <= 1:
+    for url_info in urls:
+        if not process_repo_safely(url_info):
+            students_without_revision.append(url_info['username'])
+else:
+    remaining_urls = urls
+    if url_type == 'http-save' and urls:
+        # Do the first repo by itself so that you're only asked for your
+        # password once. The other clones use the cached credentials.
+        if not process_repo_safely(urls[0]):
+            students_without_revision.append(urls[0]['username'])
+        remaining_urls = urls[1:]
+    print("Working on %d repos at a time." % jobs)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(process_repo_buffered, remaining_urls)
+        for url_info, has_revision in zip(remaining_urls, results):
+            if not has_revision:
+                students_without_revision.append(url_info['username'])
+
+if sync:
+    save_state(sync_state_file, sync_state)
+if resolver == 'push-index':
+    save_state(push_index_file, push_index)
 
 # Erase saved http credentials
 if url_type == 'http-save':
@@ -2,6 +2,8 @@
 
 # contains any global variables for use by multiple files
 
+import os
+
 # the hostname where the GitLab server is hosted
 # do not include ending slash '/'
 # fqdn means Fully Qualified Domain Name
@@ -16,3 +18,47 @@ else:
 
 # this is the regular URL
 host_url = proto_type + host_url_just_fqdn
+
+# GITLAB_URL in the environment replaces host_url, ex. to run the scripts
+# against a test server like mock_gitlab.py:
+#     GITLAB_URL=http://127.0.0.1:8080 python3 clone.py ...
+if os.environ.get('GITLAB_URL'):
+    host_url = os.environ['GITLAB_URL'].rstrip('/')
+
+# settings for the keep-alive connection pool used by simple_gitlab.request
+# http_pool_size: the most connections that will be open to one host at once.
+#                 Extra requests wait for a connection to be returned.
+# http_pool_idle_timeout: seconds an unused connection is kept open before
+#                         it's thrown away and a new one is made
+# http_timeout: seconds to wait on the socket before a request gives up
+http_pool_size = 4
+http_pool_idle_timeout = 30
+http_timeout = 60
+
+# limits on how hard the scripts push the Gitlab server (see
+# simple_gitlab.RateLimiter). Set either one to None to turn it off.
+# api_requests_per_second: most API requests started per second
+# api_max_in_flight: most API requests waiting on the server at once.
+#                    More than http_pool_size has no effect.
+api_requests_per_second = 20
+api_max_in_flight = 4
+
+# how simple_gitlab.request retries failed requests (see simple_gitlab.RetryPolicy)
+# api_max_attempts: most tries for each request, including the first
+# api_retry_backoff: seconds before the first retry. Doubles after each try.
+# api_retry_max_backoff: most seconds between tries
+api_max_attempts = 3
+api_retry_backoff = 1
+api_retry_max_backoff = 60
+
+# when the server looks overloaded, every request is paused (see
+# simple_gitlab.CircuitBreaker)
+# api_overload_threshold: overload errors (429, 502, 503, 504 or a timeout) in
+#                         a row that pause all requests. None turns it off.
+# api_overload_pause: seconds to pause for
+api_overload_threshold = 5
+api_overload_pause = 30
+
+# seconds that users, groups and projects found by name are remembered
+# (see simple_gitlab.NameCache)
+name_cache_ttl = 60 * 60
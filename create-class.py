@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import gitlab
 import simple_gitlab
-import re
+import roster
 import argparse
 import sys
 import os
@@ -30,7 +30,9 @@ parser.add_argument('--course-section',  required=True, help="The section of the
 parser.add_argument('--add-students', const=1, type=int, nargs='?', help="Use this if you wish to also add all students for this course to the Gitlab group.")
 parser.add_argument('--file-name', nargs='?', help="The .CSV file from which you want to pull user data from.")
 
+simple_gitlab.add_profile_argument(parser)
 args = parser.parse_args()
+simple_gitlab.profile_from_args(args)
 
 # Set arguments as variables
 class_name = args.course_name
@@ -45,22 +47,27 @@ course_number = class_name[4:7]
 # Create string for the Gitlab group name based on arguments
 gitlab_group_name = subject + "-" + course_number + "-" + class_section
 
-# Add user to the group
+# Add users to the group
 
 # Pre-conditions:
 #   - Gitlab group has been successfully created
-#   - User_data is a line from the .CSV file where the course
-#   name and section match the desired Gitlab group
+#   - Students is a list of roster.Students from the .CSV file where the
+#   course name and section match the desired Gitlab group
 
 # Post-conditions:
-#   - User with credentials matching user_data is added to Gitlab group
+#   - Users with credentials matching students are added to Gitlab group
+#   - Any students that couldn't be added are printed
 
-def add_user_to_group(user_data):
-    user_name = user_data[8][0:8]
-    print("Adding " + user_name + " to " + gitlab_group_name + ".")
-    user = gl.users.list(username=user_name)[0]
+def add_users_to_group(students):
+    user_names = [student.username for student in students]
+    print("Adding " + str(len(user_names)) + " students to " + gitlab_group_name + ".")
     group = gl.groups.get(gitlab_group_name)
-    group.members.create({'user_id':user.id, 'access_level':gitlab.GUEST_ACCESS})
+    results = simple_gitlab.add_members(gl, group, user_names, access_level=gitlab.GUEST_ACCESS)
+    for user_name in user_names:
+        if results[user_name] is None:
+            print("Added " + user_name + " to " + gitlab_group_name + ".")
+        else:
+            print("Couldn't add " + user_name + " to " + gitlab_group_name + ": " + str(results[user_name]))
 
 # Create a new Gitlab group using defined group name
 
@@ -80,7 +87,6 @@ def create_group():
 
 
 
-file = None
 students = []
 if(add_students is not None):
     # --file-name flag not set
@@ -88,27 +94,20 @@ if(add_students is not None):
         print("File could not be found. Make sure you have used the '--file-name' flag correctly.")
         sys.exit()
     else:
-        # Try to open the file for reading
+        # Find the students in this course and section
         try: 
-            file = open(file_name, 'r')
+            students = roster.load(file_name).section(course_number, class_section, subject=subject)
         except FileNotFoundError:
             print("File could not be found. Make sure file exists in this directory, and you have typed the name correctly.")
             sys.exit()
 
-    # Search file for students    
-    for line in file:
-        user_data = re.split(',', line.rstrip())
-        if (course_number == user_data[1] and class_section == user_data[2]):
-            students.append(user_data)
     # If no students could be found in file with matching course number/section
     if(len(students) == 0):
         print("No students could be found for this class and section. Make sure the course number and section number are correct. GitLab group not created.")
     # If everything is OK, create new GitLab group and add all students from file
     else:
         create_group()
-        for student in students:
-            add_user_to_group(student)
-    file.close()
+        add_users_to_group(students)
 
 if(add_students is None):
     create_group()
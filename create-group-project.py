@@ -2,9 +2,9 @@
 #Creates a Gitlab group for the specified class
 import gitlab
 import simple_gitlab
-import re
 import argparse
-import sys
+import sys,csv
+import threading,concurrent.futures
 
 # This script is used to create a group projects within a certain Gitlab group.
 # The script uses a .CSV file that declares which students should be grouped together.
@@ -21,6 +21,16 @@ import sys
 #   - Each project has the specified project name, followed by its own number to 
 #   differentiate groups.
 #   - Each project includes the correct group members, loaded from the .CSV file
+#
+# Each line of the .CSV file is one team: the usernames of its members,
+# separated by commas. The team on the Nth line that isn't blank gets the
+# project "PROJECT-NAME N". The script can be run again, for example after
+# a team changes: projects that already exist are used instead of being
+# created again, and students who are already members are left alone.
+#
+# All the usernames are looked up at once at the start (one listing of
+# every user), then all the missing projects are created at the same time,
+# then all the memberships are added at the same time (see --jobs and --rate).
 
 gl = simple_gitlab.make_gitlab_obj(token_filename="test_token")
 
@@ -29,14 +39,18 @@ parser = argparse.ArgumentParser(description="This script is used to create grou
 parser.add_argument('--group-name', required=True, help="The Gitlab group name (ex. csci-408-1) that you wish to create group projects in.")
 parser.add_argument('--project-name', required=True, help="The name of the project you wish to create.")
 parser.add_argument('--file-name', required=True, help="The .CSV file from which you want to pull group member info from.")
+simple_gitlab.add_rate_limit_arguments(parser, jobs_help="Number of projects or memberships to create at the same time")
 
 
+simple_gitlab.add_profile_argument(parser)
 args = parser.parse_args()
+simple_gitlab.profile_from_args(args)
 
 # Set arguments as variables
 group_name = args.group_name
 project_name = args.project_name
 file_name = args.file_name
+jobs = simple_gitlab.rate_limit_from_args(args)
 
 # Check to see if the Gitlab group exists, and set a variable to represent it.
 group = None
@@ -44,35 +58,100 @@ group_id = None
 try:
     group = simple_gitlab.get_group_by_name(gl, group_name)
     group_id = group.id
-except:
+except (RuntimeError, gitlab.exceptions.GitlabError):
     print("Gitlab group could not be found. Make sure it exists and you typed its name in correctly.")
-    sys.exit()
+    sys.exit(1)
 
 
-# Try to open the file for reading
-file = None
-try: 
-    file = open(file_name, 'r')
+# Read the teams from the file: one list of usernames per line that isn't blank
+teams = []
+try:
+    with open(file_name, 'r', newline='') as file:
+        for row in csv.reader(file):
+            usernames = [name.strip() for name in row if name.strip()]
+            if usernames:
+                teams.append(usernames)
 except FileNotFoundError:
     print("File " + file_name + " could not be found. Make sure file exists in this directory, and you have typed the name correctly.")
-    sys.exit()
+    sys.exit(1)
+team_names = [project_name + " " + str(i) for i in range(1, len(teams) + 1)]
 
+print_lock = threading.Lock()
 
-# Read the file, for each line create a new project and add all 
-# users from that line to the project.
-i = 1
-for line in file:
-    try:
-        project = gl.projects.create({'name':project_name + " " + str(i), 
-                                    'namespace_id':group_id})
-    except:
-        print("Unable to create group project, project name may already be in use.")
-        sys.exit()
-    usernames = re.split(',', line.rstrip())
+def report(msg):
+    with print_lock:
+        print(msg, flush=True)
+
+# Look up every username at once
+print("Getting the list of users.")
+simple_gitlab.load_all_users(gl)
+user_ids = {}
+for usernames in teams:
     for name in usernames:
-        user = gl.users.list(username=name)[0]
-        project.members.create({'user_id': user.id, 'access_level': gitlab.DEVELOPER_ACCESS})
-        print("Adding: " + name + " to " + project_name + " " + str(i) + ".")
-    i = i + 1
+        user = simple_gitlab.cached_object('users', name, gl.users)
+        if user:
+            user_ids[name] = user.id
+
+# Projects that already exist in the group are used again
+print("Getting the projects in " + group_name + ".")
+existing_projects = dict((project.name, project) for project in group.projects.list(all=True, per_page=100))
+
+# Usernames of the members of each existing project that's used again
+current_members = {}
+
+# Creates the project for one team, or finds it if it already exists.
+# Returns the project, or None if it couldn't be created.
+def get_or_create_project(team_name):
+    try:
+        if team_name in existing_projects:
+            report("Using the existing project " + team_name + ".")
+            # Only the id is needed to add members
+            project = gl.projects.get(existing_projects[team_name].id, lazy=True)
+            current_members[team_name] = set(member.username for member in project.members.list(all=True, per_page=100))
+            return project
+        project = gl.projects.create({'name': team_name, 'namespace_id': group_id})
+    except gitlab.exceptions.GitlabError as e:
+        report("Unable to create group project " + team_name + ": " + str(e))
+        return None
+    report("Created project " + team_name + ".")
+    return project
+
+with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    projects = list(executor.map(get_or_create_project, team_names))
+
+# Adds one member to a project. Someone who's already a member counts as
+# added. Returns None if they were added, or the error.
+def add_member(membership):
+    team_name, project, name = membership
+    if name not in user_ids:
+        return RuntimeError("No users found with name: %s" % name)
+    try:
+        project.members.create({'user_id': user_ids[name], 'access_level': gitlab.DEVELOPER_ACCESS})
+    except gitlab.exceptions.GitlabCreateError as e:
+        # "error 409: Member already exists" means there's nothing to do
+        if e.response_code != 409:
+            return e
+    except gitlab.exceptions.GitlabError as e:
+        return e
+    return None
+
+memberships = [(team_name, project, name) for team_name, project, usernames in zip(team_names, projects, teams)
+               if project is not None for name in usernames
+               if name not in current_members.get(team_name, ())]
+already_members = sum(len(current_members[team_name] & set(usernames))
+                      for team_name, usernames in zip(team_names, teams) if team_name in current_members)
+with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    errors = list(executor.map(add_member, memberships))
 
-file.close()
+failed = 0
+for (team_name, project, name), error in zip(memberships, errors):
+    if error is None:
+        print("Adding: " + name + " to " + team_name + ".")
+    else:
+        print("Couldn't add " + name + " to " + team_name + ": " + str(error))
+        failed += 1
+missing_projects = sum(1 for project in projects if project is None)
+print("%d projects, %d could not be created. %d members added, %d already members, %d could not be added." %
+      (len(team_names), missing_projects, len(memberships) - failed, already_members, failed))
+if failed or missing_projects:
+    sys.exit(1)
@@ -3,8 +3,11 @@
 import time
 import argparse,getpass,re
 import sys,subprocess,os
+import threading,concurrent.futures
 import json,urllib.request
 import simple_gitlab
+import roster
+import journal
 from config import host_url, host_url_just_fqdn
 
 # Parse command-line arguments.
@@ -16,16 +19,39 @@ parser.add_argument('--cookie-file', default="/dev/stdin",
                     help="Path to file containing your Gitlab _gitlab_session cookie value. Default is to read from standard input.")
 parser.add_argument('--add-students', action='store_true',
                     help="By default, students will not be added to their repos. Set this option to add them, which will email them too.")
+parser.add_argument('--seed-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'repo-template'),
+                    help="Folder with the files to put in each new repo. Default is the repo-template folder next to this script.")
+parser.add_argument('--settle-timeout', type=int, default=300,
+                    help="Seconds to wait for Gitlab to protect newly created master branches. Default is 300.")
+parser.add_argument('--name-cache', metavar='FILE',
+                    help="With --add-students, save the users and projects that were looked up in FILE, and use " +
+                         "them in the next run instead of getting them from Gitlab again.")
+parser.add_argument('--jobs', type=int, default=1,
+                    help="Number of students to set up at the same time. Default is 1.")
+simple_gitlab.add_rate_limit_arguments(parser)
+parser.add_argument('--journal', metavar='FILE',
+                    help="Record each student's finished steps in FILE, and skip the steps recorded there by an " +
+                         "earlier run. See journal.py.")
 students_arg_group = parser.add_mutually_exclusive_group()
 students_arg_group.add_argument('--classlist', nargs=1, help="Path to your course's .classlist file on the student.cs Linux servers.")
 students_arg_group.add_argument('--students', help="A comma separated list of student Quest IDs. Create repositories for these students only.")
+students_arg_group.add_argument('--roster', metavar='FILE',
+                                help="A registrar .CSV file. Create repositories for the students in --course-name and --course-section.")
+parser.add_argument('--course-name', help="With --roster, the course (ex. CSCI408) to take students from.")
+parser.add_argument('--course-section', help="With --roster, the section of the course to take students from.")
+simple_gitlab.add_profile_argument(parser)
 args = parser.parse_args()
+simple_gitlab.profile_from_args(args)
 
 # save command line argument inputs in variables
 group_name = args.group_name
 token_file = args.token_file
 add_students = args.add_students
 cookie_file = args.cookie_file
+seed_dir = args.seed_dir
+settle_timeout = args.settle_timeout
+name_cache_file = args.name_cache
+jobs = simple_gitlab.rate_limit_from_args(args)
 
 # Read private token from keyboard or from file
 simple_gitlab.set_private_token(token_file)
@@ -37,68 +63,158 @@ if args.students:
     students = list(filter(lambda s: s and not s.isspace(), students))
     students = list(map(lambda s:s[:8],students))
 elif args.classlist:
-    classlist_regex = re.compile('[a-z]{2}[0-9]{6}')
-    classlist_file = args.classlist[0]
-    for line in open(classlist_file, 'r'):
-        match = classlist_regex.match(line)
-        if match != None:
-            userid = match.group(0)
-            userid = userid[0:8]
-            students.append(userid)
+    students = roster.read_classlist(args.classlist[0])
+elif args.roster:
+    if not args.course_name or not args.course_section:
+        print("--roster needs --course-name and --course-section.")
+        sys.exit(1)
+    course_name = args.course_name.lower()
+    try:
+        students = [student.username for student in
+                    roster.load(args.roster).section(course_name[4:7], args.course_section, subject=course_name[0:4])]
+    except FileNotFoundError:
+        print("File %s could not be found." % args.roster)
+        sys.exit(1)
 
 # Create a hash mapping student usernames to the id of their project/repo
 # This should be empty. If not, it means some projects have already
 # been created.
 group_id = simple_gitlab.get_group_id(group_name)
-group_data = simple_gitlab.request("groups/%d" % group_id)
+group_data = simple_gitlab.request("groups/%d" % group_id, quit_on_error=True)
 projects_data = group_data['projects']
 project_ids = {}
 for project in projects_data:
     username = project['ssh_url_to_repo'].rsplit('/',1)[-1][:-4]
     project_ids[username] = project['id']
 
-# Begin processing students
-print("Processing %d total students." % len(students))
-for student in students:
-    print(os.linesep)
-    print('-' * 60)
-    print("> Processing %s" % student)
-    
-    # Create project/repo for students who do not have one yet.
-    if student not in project_ids:
-        # Student doesn't have a project/repo yet. Create it
-        print("> %s doesn't have a project/repo yet. Creating it now." % student)
-        new_project = simple_gitlab.request('projects', post_hash={'name':student, 'namespace_id':group_id, 'visibility_level':0})
-        project_ids[student] = new_project['id']
-        print("> Created new project with id %d" % new_project['id'])
+# With --journal, steps done by earlier runs are skipped. The steps are
+# 'project' (with the project id), 'master' (with the time it was created,
+# if this script created it), 'protected' and 'member'.
+run_journal = journal.open_journal(args.journal, 'create-repos %s' % group_name)
+
+# Returns True if the journal says step was done for student
+def journaled(student, step):
+    return run_journal is not None and run_journal.is_done(student, step)
+
+def record_step(student, step, value=None):
+    if run_journal is not None:
+        run_journal.record(student, step, value)
+
+# Read the files that every new repo starts with from --seed-dir
+seed_files = simple_gitlab.read_seed_files(seed_dir)
+if not seed_files:
+    print("There are no files in the seed directory %s. New repos need at least one file." % seed_dir)
+    sys.exit(1)
+
+#
+# Set up one student's repo. With --jobs N, N students are processed at
+# once. Each student's output is collected and printed in one piece when
+# they're done, so it doesn't get mixed up with the other students' output.
+# The number of API requests is limited by simple_gitlab.rate_limiter
+# (see --rate and --max-in-flight) instead of sleeping after each student.
+#
+
+print_lock = threading.Lock()
+
+# Adds msg to output, or prints it if output is None
+def report(output, msg):
+    if output is None:
+        print(msg)
     else:
-        print("> %s already has a project (id %d). Not creating it again." % (student, project_ids[student]))
+        output.append(msg)
 
-    # Create master branch if it doesn't exist yet
+# python-gitlab object and group, only needed with --add-students
+gl = None
+current_group = None
+if add_students:
+    print("> Connecting to GitLab.")
+
+    # TODO: figure out token filename
+    gl = simple_gitlab.make_gitlab_obj(token_filename="test_token")
+    try:
+        current_group = gl.groups.get(group_id)
+    except Exception as e:
+        print("Encountered error %s!" % e)
+        print("> Could not find group with ID %s!" % group_id)
+
+    # Look up all the users at once instead of searching for each student
+    # (unless the journal says they've all been added already)
+    if name_cache_file:
+        simple_gitlab.name_cache.load(name_cache_file)
+    if not all(journaled(student, 'member') for student in students):
+        print("> Getting the list of users.")
+        simple_gitlab.load_all_users(gl)
+
+# Returns True if Gitlab has protected the master branch of student's repo
+def master_protected(student):
+    master_branch_info = simple_gitlab.request('projects/%d/repository/branches/master' % project_ids[student],
+                                               show_output=False)
+    return master_branch_info and master_branch_info['protected']
+
+def report_protected(student, seconds):
+    with print_lock:
+        print("> Master branch of %s became protected %.1f seconds after it was created." % (student, seconds), flush=True)
+    record_step(student, 'protected')
+
+# Gitlab protects a new master branch after a delay. Each one is checked in
+# the background from when it's created, while the other students are
+# processed.
+protection_poller = simple_gitlab.Poller(master_protected, timeout=settle_timeout, on_ready=report_protected)
+
+# Creates the master branch of student's repo if it doesn't exist yet.
+# What was done is added to the outcome list.
+def create_master(student, output, outcome):
     existing_branches = simple_gitlab.request('projects/%d/repository/branches' % project_ids[student])
+    if existing_branches is False:
+        raise RuntimeError("Could not get the list of branches")
     master_branch_exists = False
     for branch in existing_branches:
         if branch['name'] == 'master':
             master_branch_exists = True
     if not master_branch_exists:
-        print("> master branch doesn't exist for %s. Creating it." % student)
-        time.sleep(3)
-        for assn in ['A0', 'A1', 'A2', 'A3', 'A4']:
-            print("> Doing work for assignment %s" % assn)
-            simple_gitlab.request('projects/%d/repository/files' % project_ids[student],
-                           post_hash={'file_path':("%s/.gitignore" % assn), 'branch_name':"master", 'content':"*.class\n", 'commit_message':("Creating %s folder" % assn)})
-
-        # Wait for master branch to become protected. Gitlab seems to have a delay on protecting the
-        # master branch when it's created.
-        while True:
-            master_branch_info = simple_gitlab.request('/projects/%d/repository/branches/master' % project_ids[student], quit_on_error=False)
-            if master_branch_info and master_branch_info['protected']:
-                print("> Newly created master branch has become protected.")
-                break
-            print("> Waiting for Gitlab to make newly created master branch protected.")
-            time.sleep(1) # Don't spam Gitlab website
+        report(output, "> master branch doesn't exist for %s. Creating it." % student)
+        if not simple_gitlab.seed_repo(project_ids[student], seed_files, lambda msg: report(output, msg)):
+            raise RuntimeError("Could not commit the seed files")
+        protection_poller.add(student)
+        outcome.append("master created")
+        # The time it was created, so a later run can tell how long Gitlab took to protect it
+        record_step(student, 'master', str(time.time()))
+    else:
+        report(output, "> master branch already exists for %s. Not creating it." % student)
+        record_step(student, 'master')
+
+# Input: student: the student's username
+#        output: a list to collect output in, or None to print it directly
+# Returns: A short description of what was done, for the summary at the end
+def process_student(student, output=None):
+    report(output, os.linesep)
+    report(output, '-' * 60)
+    report(output, "> Processing %s" % student)
+    outcome = []
+
+    # Create project/repo for students who do not have one yet.
+    if student not in project_ids:
+        # Student doesn't have a project/repo yet. Create it
+        report(output, "> %s doesn't have a project/repo yet. Creating it now." % student)
+        new_project = simple_gitlab.request('projects', post_hash={'name':student, 'namespace_id':group_id, 'visibility_level':0})
+        if not new_project:
+            raise RuntimeError("Could not create the project")
+        project_ids[student] = new_project['id']
+        simple_gitlab.name_cache.invalidate('projects', (group_name, student))
+        report(output, "> Created new project with id %d" % new_project['id'])
+        outcome.append("project created")
+    else:
+        report(output, "> %s already has a project (id %d). Not creating it again." % (student, project_ids[student]))
+    record_step(student, 'project', str(project_ids[student]))
+
+    # Create master branch if it doesn't exist yet
+    if journaled(student, 'master'):
+        report(output, "> master branch was created by an earlier run (see --journal). Not checking it again.")
+        created_at = run_journal.value(student, 'master')
+        if created_at and not journaled(student, 'protected'):
+            protection_poller.add(student, time.monotonic() - (time.time() - float(created_at)))
     else:
-        print("> master branch already exists for %s. Not creating it." % student)
+        create_master(student, output, outcome)
 
     # Turn off master branch protection (on by default). At this point
     # in the code, we have created master branch if it doesn't exist.
@@ -107,22 +223,13 @@ for student in students:
 
     # print("> Unprotecting master branch.")
     # simple_gitlab.request('/projects/%d/repository/branches/master/unprotect' % project_ids[student], http_method='PUT')
-        
+
     # The repo is now set up with an unprotected master branch.
     # Do email invitation if user wants to do that.
-    if add_students:
-
-        print("> Connecting to GitLab.")
-
-        # TODO: figure out token filename 
-        gl = simple_gitlab.make_gitlab_obj(token_filename="test_token")
-        try:
-            current_group = gl.groups.get(group_id)
-        except Exception as e:
-            print("Encountered error %s!" % e)
-            print("> Could not find group with ID %s!" % group_id)
-
-        print("> Adding student to project/repository.")
+    if add_students and journaled(student, 'member'):
+        report(output, "> Student was added to the project by an earlier run (see --journal).")
+    elif add_students:
+        report(output, "> Adding student to project/repository.")
 
         # the project name will be the student's username, so get that
         # proj_name = None
@@ -132,15 +239,82 @@ for student in students:
         #     print("Encountered error `%s` while finding user" % e)
         #     print("> Could not add student %s to repo!" % student)
 
-        student_id = simple_gitlab.get_user_by_name(gl, student).id
         # try:
-        simple_gitlab.add_user_to_project(gl, student_id, student, \
-                                              g_name=current_group.name)
-        print("Student added as member of %s/%s." % (current_group.name, student))
+        # add_members counts a student who's already a member (ex. on a
+        # rerun without --journal) as added, instead of failing
+        project = gl.projects.get(project_ids[student], lazy=True)
+        error = simple_gitlab.add_members(gl, project, [student], jobs=1)[student]
+        if error is not None:
+            raise error
+        report(output, "Student is a member of %s/%s." % (current_group.name, student))
+        record_step(student, 'member')
+        outcome.append("student added")
         # except Exception as e:
         #     print("Encountered error `%s` while adding user" % e)
         #     print("> Could not add student %s to repo!" % student)
 
+    report(output, "> Done processing %s." % student)
+    return ', '.join(outcome) if outcome else "nothing to do"
+
+# Runs process_student and returns its outcome. If anything goes wrong, the
+# error is reported and the other students are still processed. With
+# buffered=True (used by the worker pool), the student's output is printed
+# all at once at the end.
+def run_student(student, buffered=False):
+    output = [] if buffered else None
+    if run_journal is not None:
+        run_journal.set_status(student, journal.working)
+    try:
+        outcome = process_student(student, output)
+        if run_journal is not None:
+            run_journal.set_status(student, journal.done, outcome)
+    except Exception as e:
+        report(output, "> Error %s message: %s" % (type(e).__name__, str(e)))
+        report(output, "> Could not finish processing %s." % student)
+        outcome = "FAILED (%s: %s)" % (type(e).__name__, str(e))
+        if run_journal is not None:
+            run_journal.set_status(student, journal.failed, outcome)
+    if buffered:
+        with print_lock:
+            print(os.linesep.join(output), flush=True)
+    return outcome
+
+# Begin processing students
+print("Processing %d total students." % len(students))
+if run_journal is not None:
+    run_journal.start_run(students)
+if jobs <= 1:
+    outcomes = [run_student(student) for student in students]
+else:
+    print("Processing %d students at a time." % jobs)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        outcomes = list(executor.map(lambda student: run_student(student, buffered=True), students))
+
+# Wait for Gitlab to protect the new master branches.
+if protection_poller.settle_times:
+    print(os.linesep)
+    print('-' * 60)
+    print("> Waiting for Gitlab to finish protecting %d newly created master branches." % len(protection_poller.settle_times))
+    settle_times = protection_poller.finish()
+    for i, student in enumerate(students):
+        if student not in settle_times:
+            continue
+        if settle_times[student] is None:
+            outcomes[i] += ", master not protected after %d seconds" % settle_timeout
+        else:
+            outcomes[i] += ", protected after %.1fs" % settle_times[student]
+
+print(os.linesep)
+print('-' * 60)
+print("Summary:")
+name_width = max([len(student) for student in students] + [len("Student")])
+print("\t%s   Outcome" % "Student".ljust(name_width))
+print("\t%s   ---------------" % ("-" * name_width))
+for student, outcome in zip(students, outcomes):
+    print("\t%s   %s" % (student.ljust(name_width), outcome))
+
+if add_students and name_cache_file:
+    simple_gitlab.name_cache.save(name_cache_file)
 
-    print("> Done processing %s." % student)
-    time.sleep(5) # Put in a bit of a delay so that codestore.cs.edinboro.edu isn't hammered
+if run_journal is not None:
+    run_journal.finish_run()
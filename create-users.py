@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
 import simple_gitlab
-import re
+import roster
+import journal
 import argparse
+import sys
+import json,csv
+import threading,concurrent.futures
+import gitlab
 
 # This script is used alongside a classlist .csv file to create Gitlab user accounts for
 # all students in a certain class and section.
+#
+# Every user on the server is listed once at the start, and students whose
+# username or email is already taken are skipped without asking Gitlab
+# again. The rest of the accounts are created several at a time (see --jobs
+# and --rate). What happened to each student (created, skipped or failed,
+# and why) is printed at the end, and with --report, saved to a file.
 
-# Pre-conditions: 
+# Pre-conditions:
 #   - The system has been properly installed
 #   - Person using this script has admin access to the Gitlab server
 #   - A .csv file has been provided with the correct formatting (for formatting, see quick-start guide)
@@ -24,17 +35,41 @@ parser = argparse.ArgumentParser(description="This script is used to create any
 parser.add_argument('--file-name',  required=True, help="The .CSV file from which you want to pull user data from.")
 parser.add_argument('--course-number',  required=True, help="The course number (ex. 125) of the desired course to add users from.")
 parser.add_argument('--course-section',  required=True, help="The section of the course to add users from.")
+simple_gitlab.add_rate_limit_arguments(parser, jobs_help="Number of accounts to create at the same time")
+parser.add_argument('--report', metavar='FILE',
+                    help="Save what happened to each student (created, skipped or failed, and why) in FILE.")
+parser.add_argument('--report-format', choices=['json', 'csv'],
+                    help="Format of the --report file: newline-delimited JSON or CSV. Default is csv if FILE ends " +
+                         "in .csv, json otherwise.")
+parser.add_argument('--journal', metavar='FILE',
+                    help="Record the accounts created in FILE, and skip the students recorded there by an earlier run. See journal.py.")
+simple_gitlab.add_profile_argument(parser)
 args = parser.parse_args()
+simple_gitlab.profile_from_args(args)
 
 #Set arguments as variables
 file_name = args.file_name
 class_name = args.course_number
 class_section = args.course_section
+jobs = simple_gitlab.rate_limit_from_args(args)
+report_format = args.report_format or ('csv' if args.report and args.report.lower().endswith('.csv') else 'json')
+run_journal = journal.open_journal(args.journal, 'create-users')
+
+# What happened to each student. The report has one record per student
+# with these fields. status is 'created', 'skipped' or 'failed'.
+report_fields = ['username', 'email', 'name', 'status', 'reason', 'user_id']
+created = 'created'
+skipped = 'skipped'
+failed = 'failed'
 
-# Pulls user information from the file
+def make_record(student, status, reason='', user_id=None):
+    return {'username': student.username, 'email': student.email, 'name': student.name,
+            'status': status, 'reason': reason, 'user_id': user_id}
+
+# Creates a user account for one student
 
 # Pre-conditions:
-#   - .CSV file has been properly defined and is opened for reading
+#   - user is a roster.Student from the .CSV file
 
 # Post-conditions:
 #   - User account is created using the information passed to the funciton by users argument
@@ -43,40 +78,119 @@ class_section = args.course_section
 # Username = Edinboro email address up to the @
 # Password = Lastname (with capital first letter) + 6 digit number in Edinboro email
 # Name = First and last name
+
+# Returns: the student's report record
 def createUser(user):
-    email = user[8]
-    username = user[8][0:8]
-    password = user[5] + user[8][2:8]
-    name = user[6] + " " + user[5]
-    try:  
+    email = user.email
+    username = user.username
+    password = user.last_name + user.email[2:8]
+    name = user.name
+    try:
         # Create user account using data from file
         createUser = gl.users.create({'email': email,
                                 'password': password,
                                 'username': username,
                                 'name': name})
-    except:
-        print("Couldn't create student account, account may already exist.")
-                            
-
-
-
-# Parse file, find any entries that match the above input
-# and send entries to the create user function
-found = False
-try: 
-    file = open(file_name, 'r')
-    for line in file:
-        user_data = re.split(',', line.rstrip())
-        if (class_name == user_data[1] and class_section == user_data[2]):
-            print("Adding: " + user_data[6] + " " + user_data[5])
-            found = True
-            createUser(user_data)
-    file.close()
+    except gitlab.exceptions.GitlabCreateError as e:
+        # 409: someone else made the account since the users were listed
+        if e.response_code == 409:
+            return make_record(user, skipped, "already exists (%s)" % e.error_message)
+        return make_record(user, failed, "error %s: %s" % (e.response_code, e.error_message))
+    except (gitlab.exceptions.GitlabError, OSError) as e:
+        return make_record(user, failed, "%s: %s" % (type(e).__name__, str(e)))
+    if run_journal is not None:
+        run_journal.record(username, 'account', str(createUser.id))
+    return make_record(user, created, user_id=createUser.id)
+
+# Find the students in the file that match the above input
+try:
+    students = roster.load(file_name).section(class_name, class_section)
 except FileNotFoundError:
     print("File could not be found. Make sure file exists in this directory, and you have typed the name correctly.")
-
-if(found == False):
+    students = []
+if not students:
     print("No students could be found for this class and section. Make sure the course number and section number are correct.")
-
-
-
+    sys.exit(1)
+
+# Get every user on the server once, so students who already have an
+# account are skipped without a request each
+print("Getting the list of users.")
+existing_usernames = {}
+existing_emails = {}
+for user in gl.users.list(all=True, per_page=100):
+    existing_usernames[user.username.lower()] = user.id
+    if getattr(user, 'email', None):
+        existing_emails[user.email.lower()] = user.username
+
+# Work out which students need an account. A student listed twice only
+# gets one.
+records = {}
+to_create = []
+seen = set()
+for student in students:
+    username = student.username.lower()
+    if username in seen:
+        continue
+    seen.add(username)
+    if run_journal is not None and run_journal.is_done(student.username, 'account'):
+        records[student.username] = make_record(student, skipped, "created by an earlier run (see --journal)",
+                                                run_journal.value(student.username, 'account'))
+    elif username in existing_usernames:
+        records[student.username] = make_record(student, skipped, "username already exists",
+                                                existing_usernames[username])
+    elif student.email.lower() in existing_emails:
+        records[student.username] = make_record(student, skipped, "email already used by %s" %
+                                                existing_emails[student.email.lower()])
+    else:
+        to_create.append(student)
+
+print("%d students, %d already have an account, creating %d." % (len(students), len(records), len(to_create)))
+if run_journal is not None:
+    run_journal.start_run([student.username for student in to_create])
+
+print_lock = threading.Lock()
+
+def create_and_print(student):
+    record = createUser(student)
+    with print_lock:
+        if record['status'] == created:
+            print("Added: " + student.name + " (" + student.username + ")")
+        else:
+            print("Couldn't add " + student.name + " (" + student.username + "): " + record['reason'])
+    if run_journal is not None:
+        run_journal.set_status(student.username, journal.done if record['status'] != failed else journal.failed,
+                               record['reason'] or record['status'])
+    return record
+
+with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    for record in executor.map(create_and_print, to_create):
+        records[record['username']] = record
+if run_journal is not None:
+    run_journal.finish_run()
+
+# Report, in class list order
+report = []
+for student in students:
+    record = records.pop(student.username, None)
+    if record:
+        report.append(record)
+
+if args.report:
+    with open(args.report, 'w', newline='') as f:
+        if report_format == 'csv':
+            writer = csv.DictWriter(f, fieldnames=report_fields)
+            writer.writeheader()
+            writer.writerows(report)
+        else:
+            for record in report:
+                f.write(json.dumps(record) + '\n')
+
+counts = dict((status, sum(1 for record in report if record['status'] == status)) for status in [created, skipped, failed])
+print("Summary: %d created, %d skipped, %d failed." % (counts[created], counts[skipped], counts[failed]))
+for record in report:
+    if record['status'] == failed:
+        print("\tFailed %s: %s" % (record['username'], record['reason']))
+if args.report:
+    print("Saved the report to %s." % args.report)
+if counts[failed]:
+    sys.exit(1)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# A checkpoint journal for scripts that set up many students, like
+# create-repos.py and create-users.py (see their --journal option).
+#
+# Every step finished for a student (ex. project created, master branch
+# seeded, student added) is written to an SQLite file as soon as it's done.
+# If the script stops part way (a network problem, Ctrl-C, or an API error
+# that quits), running it again with the same journal skips the steps that
+# were already done, without asking Gitlab again. A journal can hold
+# several scripts' runs; each one writes under its own scope, ex.
+# 'create-repos csci-408-1'.
+#
+# The journal can be read while a script is writing it. To see how a long
+# run is going from another terminal:
+#     python3 journal.py FILE
+#     python3 journal.py FILE --watch 5
+#
+# The journal only knows what the scripts did, so if something is changed
+# by hand on Gitlab (ex. a project is deleted), delete the journal file or
+# run the script without --journal.
+
+import argparse
+import sqlite3,threading
+import sys,os,time
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    pid INTEGER,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    students INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS students (
+    scope TEXT NOT NULL,
+    student TEXT NOT NULL,
+    status TEXT NOT NULL,
+    detail TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (scope, student));
+CREATE TABLE IF NOT EXISTS steps (
+    scope TEXT NOT NULL,
+    student TEXT NOT NULL,
+    step TEXT NOT NULL,
+    value TEXT,
+    done_at REAL NOT NULL,
+    PRIMARY KEY (scope, student, step));
+"""
+
+# A student's status is one of these
+pending = 'pending'
+working = 'working'
+done = 'done'
+failed = 'failed'
+
+class Journal:
+    # Input: path: the SQLite file. It's created if it doesn't exist.
+    #        scope: what the steps are recorded under, ex. 'create-repos csci-408-1'
+    # Raises sqlite3.Error if path can't be opened as a journal.
+    def __init__(self, path, scope):
+        self.path = path
+        self.scope = scope
+        self.run_id = None
+        self._lock = threading.Lock()
+        # Several threads write through one connection, one at a time
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        # WAL lets another process read the journal while it's being written
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(schema)
+        self._steps = {}
+        for student, step, value in self._db.execute('SELECT student, step, value FROM steps WHERE scope = ?', (scope,)):
+            self._steps[(student, step)] = value
+
+    # Records that a run over students is starting. Students that aren't in
+    # the journal yet are added as pending.
+    def start_run(self, students):
+        now = time.time()
+        with self._lock:
+            self.run_id = self._db.execute('INSERT INTO runs (scope, pid, started_at, students) VALUES (?, ?, ?, ?)',
+                                           (self.scope, os.getpid(), now, len(students))).lastrowid
+            self._db.executemany("INSERT OR IGNORE INTO students (scope, student, status, updated_at) VALUES (?, ?, ?, ?)",
+                                 [(self.scope, student, pending, now) for student in students])
+
+    def finish_run(self):
+        with self._lock:
+            self._db.execute('UPDATE runs SET finished_at = ? WHERE id = ?', (time.time(), self.run_id))
+
+    # Returns True if step was done for student in this or an earlier run
+    def is_done(self, student, step):
+        return (student, step) in self._steps
+
+    # Returns the value recorded with step, or None
+    def value(self, student, step):
+        return self._steps.get((student, step))
+
+    # Records that step is done for student. value is an optional string to
+    # keep with it, ex. the id of the project that was created. A step that's
+    # already recorded with the same value isn't written again.
+    def record(self, student, step, value=None):
+        if (student, step) in self._steps and self._steps[(student, step)] == value:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO steps (scope, student, step, value, done_at) VALUES (?, ?, ?, ?, ?)',
+                             (self.scope, student, step, value, now))
+            self._steps[(student, step)] = value
+
+    # Sets student's status (pending, working, done or failed), with a short
+    # description for the progress listing
+    def set_status(self, student, status, detail=''):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO students (scope, student, status, detail, updated_at) ' +
+                             'VALUES (?, ?, ?, ?, ?)', (self.scope, student, status, detail, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+# Opens the journal at path for scope, or returns None if path is None.
+# Prints a message and exits if the file isn't a journal.
+def open_journal(path, scope):
+    if path is None:
+        return None
+    try:
+        return Journal(path, scope)
+    except sqlite3.Error as e:
+        print("Could not open the journal %s: %s" % (path, str(e)))
+        sys.exit(1)
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) if timestamp else '-'
+
+# Prints how far each scope in the journal at path has got: the last run,
+# the number of students with each status, the steps done, and the
+# students that failed.
+def print_progress(path):
+    db = sqlite3.connect(path, timeout=30)
+    try:
+        scopes = [row[0] for row in db.execute('SELECT DISTINCT scope FROM students ORDER BY scope')]
+        if not scopes:
+            print("%s has no runs yet." % path)
+        for scope in scopes:
+            run = db.execute('SELECT pid, started_at, finished_at, students FROM runs WHERE scope = ? ' +
+                             'ORDER BY id DESC LIMIT 1', (scope,)).fetchone()
+            statuses = dict(db.execute('SELECT status, COUNT(*) FROM students WHERE scope = ? GROUP BY status', (scope,)))
+            total = sum(statuses.values())
+            print("%s:" % scope)
+            if run:
+                pid, started_at, finished_at, students = run
+                state = "finished %s" % format_time(finished_at) if finished_at else "not finished (process %d)" % pid
+                print("\tLast run started %s with %d students, %s" % (format_time(started_at), students, state))
+            print("\t%d of %d students done, %d working, %d pending, %d failed" %
+                  (statuses.get(done, 0), total, statuses.get(working, 0), statuses.get(pending, 0), statuses.get(failed, 0)))
+            for step, count, last_done in db.execute('SELECT step, COUNT(*), MAX(done_at) FROM steps WHERE scope = ? ' +
+                                                     'GROUP BY step ORDER BY MIN(done_at)', (scope,)):
+                print("\t\t%-20s %6d   (last at %s)" % (step, count, format_time(last_done)))
+            for student, detail in db.execute('SELECT student, detail FROM students WHERE scope = ? AND status = ? ' +
+                                              'ORDER BY student', (scope, failed)):
+                print("\tFailed: %s   %s" % (student, detail))
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shows the progress recorded in a journal file.")
+    parser.add_argument('journal', help="The journal file, as given to --journal.")
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help="Show the progress again every SECONDS seconds, until Ctrl-C.")
+    args = parser.parse_args()
+    if not os.path.exists(args.journal):
+        print("%s doesn't exist." % args.journal)
+        sys.exit(1)
+    while True:
+        print_progress(args.journal)
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+        print()
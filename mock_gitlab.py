@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+
+# A small stand-in for a Gitlab server, for trying out and benchmarking the
+# scripts without touching the real one. It keeps users, groups, projects,
+# members, branches and push events in memory and answers the API calls
+# that simple_gitlab.request, async_gitlab and python-gitlab make, under
+# both /api/v3/ and /api/v4/. It can add latency to every request and
+# answer some of them with errors, to see how the scripts cope.
+#
+# To run the scripts against it, start it and point them at it with the
+# GITLAB_URL environment variable (see config.py):
+#
+#     python3 mock_gitlab.py --port 8080 --repo-dir /tmp/mock-repos &
+#     echo anything > test_token
+#     GITLAB_URL=http://127.0.0.1:8080 python3 create-class.py ...
+#
+# Any private token is accepted. With --repo-dir, commits made through the
+# API are written to bare git repositories in that folder, and the
+# projects' clone URLs point to them (file://), so clone.py works too.
+#
+# benchmark.py starts one of these in the same process (see MockGitlab
+# and start_server) to time the scripts.
+
+import argparse
+import collections
+import http.server
+import base64,json,os,random,re,subprocess,sys
+import threading,time
+import urllib.parse
+
+
+def now_string(when=None):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(when))
+
+# Raised by the request handlers to send an error response
+class MockError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+
+#
+# The server's data. All the handlers below take the same arguments:
+#   params: a dictionary of the query string and body arguments
+#   path_args: the parts of the path matched by the route, ex. the project id
+# and return (HTTP status, python object to send as JSON).
+#
+class MockGitlab:
+    # Input: latency: seconds added to every API request
+    #        jitter: up to this many more seconds are added at random
+    #        error_rate: fraction (0 to 1) of API requests answered with error_status
+    #        error_status: HTTP status of those errors, ex. 500 or 429
+    #        retry_after: seconds sent in the Retry-After header of 429 and 503 errors
+    #        protect_delay: seconds after a master branch is created before it's protected
+    #        repo_dir: folder to write bare git repos to, or None to only keep commits in memory
+    def __init__(self, latency=0, jitter=0, error_rate=0, error_status=500, retry_after=1,
+                 protect_delay=0, repo_dir=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.protect_delay = protect_delay
+        self.repo_dir = os.path.abspath(repo_dir) if repo_dir else None
+        self.host = 'mock.gitlab'
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.users = {}
+        self.groups = {}
+        self.projects = {}
+        self.members = {}   # ('groups' or 'projects', id) -> {user id: access level}
+        self.branches = {}  # project id -> {branch name: branch hash}
+        self.events = {}    # project id -> list of push events, oldest first
+        self.request_counts = collections.Counter()
+        self.errors_sent = 0
+
+        self.routes = []
+        for method, pattern, handler in [
+                ('GET', 'groups', self.list_groups),
+                ('POST', 'groups', self.create_group),
+                ('GET', 'groups/:id', self.get_group),
+                ('GET', 'groups/:id/projects', self.list_group_projects),
+                ('GET', 'groups/:id/members', self.list_members),
+                ('POST', 'groups/:id/members', self.add_member),
+                ('GET', 'groups/:id/members/:user', self.get_member),
+                ('GET', 'users', self.list_users),
+                ('POST', 'users', self.create_user),
+                ('GET', 'users/:id', self.get_user),
+                ('GET', 'projects', self.list_projects),
+                ('POST', 'projects', self.create_project),
+                ('GET', 'projects/:id', self.get_project),
+                ('GET', 'projects/:id/members', self.list_members),
+                ('POST', 'projects/:id/members', self.add_member),
+                ('GET', 'projects/:id/members/:user', self.get_member),
+                ('GET', 'projects/:id/events', self.list_events),
+                ('GET', 'projects/:id/repository/branches', self.list_branches),
+                ('GET', 'projects/:id/repository/branches/:branch', self.get_branch),
+                ('PUT', 'projects/:id/repository/branches/:branch/protect', self.protect_branch),
+                ('PUT', 'projects/:id/repository/branches/:branch/unprotect', self.unprotect_branch),
+                ('POST', 'projects/:id/repository/commits', self.create_commit),
+                ('POST', 'projects/:id/repository/files', self.create_file)]:
+            regex = re.compile('^' + re.sub(':[a-z]+', '([^/]+)', pattern) + '$')
+            self.routes.append((method, regex, '%s %s' % (method, pattern), handler))
+
+    # Returns the request counts since the last call, as a dictionary of
+    # route (ex. 'GET projects/:id') -> number of requests, and starts counting again
+    def take_request_counts(self):
+        with self.lock:
+            counts = dict(self.request_counts)
+            self.request_counts.clear()
+        return counts
+
+    def new_id(self):
+        new_id = self.next_id
+        self.next_id += 1
+        return new_id
+
+    # Finds a user, group or project by id, or by path for groups and projects
+    def find(self, table, key, kind):
+        if key.isdigit() and int(key) in table:
+            return table[int(key)]
+        key = urllib.parse.unquote(key)
+        for item in table.values():
+            if key in (item.get('path'), item.get('path_with_namespace')):
+                return item
+        raise MockError(404, "404 %s Not Found" % kind)
+
+    # ------Groups------
+
+    def list_groups(self, params, path_args):
+        return 200, [self.group_json(group) for group in self.groups.values()
+                     if matches_search(group, params.get('search'), ['name', 'path'])]
+
+    def create_group(self, params, path_args):
+        if not params.get('name') or not params.get('path'):
+            raise MockError(400, "name and path are required")
+        for group in self.groups.values():
+            if params['path'] in (group['name'], group['path']) or params['name'] == group['name']:
+                raise MockError(400, "Failed to save group {:path=>[\"has already been taken\"]}")
+        group = {'id': self.new_id(), 'name': params['name'], 'path': params['path'],
+                 'description': params.get('description', ''), 'visibility_level': 0}
+        self.groups[group['id']] = group
+        self.members[('groups', group['id'])] = {}
+        return 201, self.group_json(group)
+
+    def get_group(self, params, path_args):
+        group = self.find(self.groups, path_args[0], 'Group')
+        group_json = self.group_json(group)
+        group_json['projects'] = [self.project_json(project) for project in self.projects.values()
+                                  if project['namespace_id'] == group['id']]
+        return 200, group_json
+
+    def list_group_projects(self, params, path_args):
+        group = self.find(self.groups, path_args[0], 'Group')
+        return 200, [self.project_json(project) for project in self.projects.values()
+                     if project['namespace_id'] == group['id'] and matches_search(project, params.get('search'), ['name'])]
+
+    def group_json(self, group):
+        group_json = dict(group)
+        group_json['web_url'] = 'http://%s/groups/%s' % (self.host, group['path'])
+        return group_json
+
+    # ------Users------
+
+    def list_users(self, params, path_args):
+        users = self.users.values()
+        if params.get('username'):
+            users = [user for user in users if user['username'].lower() == params['username'].lower()]
+        return 200, [dict(user) for user in users if matches_search(user, params.get('search'), ['username', 'name', 'email'])]
+
+    def create_user(self, params, path_args):
+        for field in ['email', 'password', 'username', 'name']:
+            if not params.get(field):
+                raise MockError(400, "%s is missing" % field)
+        for user in self.users.values():
+            if user['username'] == params['username']:
+                raise MockError(409, "Username has already been taken")
+            if user['email'] == params['email']:
+                raise MockError(409, "Email has already been taken")
+        user = {'id': self.new_id(), 'username': params['username'], 'name': params['name'],
+                'email': params['email'], 'state': 'active', 'created_at': now_string()}
+        self.users[user['id']] = user
+        return 201, dict(user)
+
+    def get_user(self, params, path_args):
+        return 200, dict(self.find(self.users, path_args[0], 'User'))
+
+    # ------Projects------
+
+    def list_projects(self, params, path_args):
+        return 200, [self.project_json(project) for project in self.projects.values()
+                     if matches_search(project, params.get('search'), ['name', 'path'])]
+
+    def create_project(self, params, path_args):
+        if not params.get('name'):
+            raise MockError(400, "name is missing")
+        namespace_id = int(params.get('namespace_id') or 0)
+        if namespace_id not in self.groups:
+            raise MockError(404, "404 Namespace Not Found")
+        path = params.get('path') or re.sub('[^A-Za-z0-9_.-]+', '-', params['name'])
+        path_with_namespace = '%s/%s' % (self.groups[namespace_id]['path'], path)
+        for project in self.projects.values():
+            if project['path_with_namespace'] == path_with_namespace:
+                raise MockError(400, "Failed to save project {:name=>[\"has already been taken\"]}")
+        project = {'id': self.new_id(), 'name': params['name'], 'path': path, 'namespace_id': namespace_id,
+                   'path_with_namespace': path_with_namespace,
+                   'visibility_level': int(params.get('visibility_level') or 0),
+                   'created_at': now_string(), 'last_activity_at': now_string()}
+        self.projects[project['id']] = project
+        self.members[('projects', project['id'])] = {}
+        self.branches[project['id']] = {}
+        self.events[project['id']] = []
+        return 201, self.project_json(project)
+
+    def get_project(self, params, path_args):
+        return 200, self.project_json(self.find(self.projects, path_args[0], 'Project'))
+
+    def project_json(self, project):
+        project_json = dict((key, value) for key, value in project.items() if key != 'namespace_id')
+        group = self.groups[project['namespace_id']]
+        project_json['namespace'] = {'id': group['id'], 'name': group['name'], 'path': group['path']}
+        if self.repo_dir:
+            repo_url = 'file://' + self.repo_path(project)
+            project_json['ssh_url_to_repo'] = repo_url
+            project_json['http_url_to_repo'] = repo_url
+        else:
+            project_json['ssh_url_to_repo'] = 'git@%s:%s.git' % (self.host, project['path_with_namespace'])
+            project_json['http_url_to_repo'] = 'http://%s/%s.git' % (self.host, project['path_with_namespace'])
+        project_json['web_url'] = 'http://%s/%s' % (self.host, project['path_with_namespace'])
+        project_json['default_branch'] = 'master' if 'master' in self.branches[project['id']] else None
+        return project_json
+
+    # ------Members------
+
+    def list_members(self, params, path_args):
+        kind = 'groups' if params['_route'].startswith('GET groups') else 'projects'
+        target = self.find(self.groups if kind == 'groups' else self.projects, path_args[0], kind[:-1].title())
+        members = []
+        for user_id, access_level in self.members[(kind, target['id'])].items():
+            member = dict(self.users[user_id])
+            member['access_level'] = access_level
+            members.append(member)
+        return 200, members
+
+    def get_member(self, params, path_args):
+        kind = 'groups' if params['_route'].startswith('GET groups') else 'projects'
+        target = self.find(self.groups if kind == 'groups' else self.projects, path_args[0], kind[:-1].title())
+        user = self.find(self.users, path_args[1], 'User')
+        members = self.members[(kind, target['id'])]
+        if user['id'] not in members:
+            raise MockError(404, "404 Member Not Found")
+        member = dict(user)
+        member['access_level'] = members[user['id']]
+        return 200, member
+
+    def add_member(self, params, path_args):
+        kind = 'groups' if params['_route'].startswith('POST groups') else 'projects'
+        target = self.find(self.groups if kind == 'groups' else self.projects, path_args[0], kind[:-1].title())
+        user = self.find(self.users, str(params.get('user_id', '')), 'User')
+        members = self.members[(kind, target['id'])]
+        if user['id'] in members:
+            raise MockError(409, "Member already exists")
+        members[user['id']] = int(params.get('access_level') or 30)
+        member = dict(user)
+        member['access_level'] = members[user['id']]
+        return 201, member
+
+    # ------Branches and commits------
+
+    def list_branches(self, params, path_args):
+        project = self.find(self.projects, path_args[0], 'Project')
+        return 200, [self.branch_json(branch) for branch in self.branches[project['id']].values()]
+
+    def get_branch(self, params, path_args):
+        project = self.find(self.projects, path_args[0], 'Project')
+        branch = self.branches[project['id']].get(urllib.parse.unquote(path_args[1]))
+        if branch is None:
+            raise MockError(404, "404 Branch Not Found")
+        return 200, self.branch_json(branch)
+
+    def protect_branch(self, params, path_args):
+        return self.set_protected(path_args, True)
+
+    def unprotect_branch(self, params, path_args):
+        return self.set_protected(path_args, False)
+
+    def set_protected(self, path_args, protected):
+        status, branch_json = self.get_branch({}, path_args)
+        branch = self.branches[self.find(self.projects, path_args[0], 'Project')['id']][branch_json['name']]
+        branch['protected_at'] = time.time() if protected else None
+        return 200, self.branch_json(branch)
+
+    def branch_json(self, branch):
+        protected = branch['protected_at'] is not None and branch['protected_at'] <= time.time()
+        return {'name': branch['name'], 'protected': protected, 'commit': dict(branch['commit'])}
+
+    # The commits API (Gitlab 8.13 and up): one commit with many files
+    def create_commit(self, params, path_args):
+        files = []
+        for action in params.get('actions') or []:
+            if action.get('action') != 'create':
+                raise MockError(400, "Only the create action is supported by this server")
+            files.append((action['file_path'], action.get('content', ''), action.get('encoding', 'text')))
+        if not files:
+            raise MockError(400, "actions is missing")
+        return self.commit_files(path_args[0], params, files)
+
+    # The files API: one commit per file
+    def create_file(self, params, path_args):
+        if not params.get('file_path'):
+            raise MockError(400, "file_path is missing")
+        return self.commit_files(path_args[0], params,
+                                 [(params['file_path'], params.get('content', ''), params.get('encoding', 'text'))])
+
+    def commit_files(self, project_key, params, files):
+        project = self.find(self.projects, project_key, 'Project')
+        branch_name = params.get('branch_name') or params.get('branch')
+        message = params.get('commit_message')
+        if not branch_name or not message:
+            raise MockError(400, "branch and commit_message are required")
+        branches = self.branches[project['id']]
+        previous = branches.get(branch_name)
+        committed_at = time.time()
+        if self.repo_dir:
+            # Other requests don't have to wait for git
+            self.lock.release()
+            try:
+                commit_id = write_commit(self.repo_path(project), branch_name, files, message,
+                                         previous['commit']['id'] if previous else None, committed_at)
+            finally:
+                self.lock.acquire()
+        else:
+            commit_id = '%040x' % random.getrandbits(160)
+        commit = {'id': commit_id, 'short_id': commit_id[:8], 'title': message.split('\n')[0],
+                  'message': message, 'committed_date': now_string(committed_at)}
+        if previous:
+            previous['commit'] = commit
+        else:
+            # Like Gitlab, a new master branch is protected (after protect_delay seconds)
+            branches[branch_name] = {'name': branch_name, 'commit': commit,
+                                     'protected_at': committed_at + self.protect_delay if branch_name == 'master' else None}
+        self.events[project['id']].append({
+            'action_name': 'pushed to' if previous else 'pushed new',
+            'created_at': now_string(committed_at),
+            'data': {'ref': 'refs/heads/' + branch_name, 'before': previous['commit']['id'] if previous else '0' * 40,
+                     'after': commit_id},
+            'push_data': {'ref': branch_name, 'commit_to': commit_id}})
+        project['last_activity_at'] = now_string(committed_at)
+        return 201, commit
+
+    def repo_path(self, project):
+        return os.path.join(self.repo_dir, project['path_with_namespace'] + '.git')
+
+    # Push events, newest first. Supports the action, before and after filters.
+    def list_events(self, params, path_args):
+        project = self.find(self.projects, path_args[0], 'Project')
+        events = list(reversed(self.events[project['id']]))
+        if params.get('action') and params['action'] != 'pushed':
+            events = []
+        if params.get('before'):
+            events = [event for event in events if event['created_at'][:10] < params['before']]
+        if params.get('after'):
+            events = [event for event in events if event['created_at'][:10] > params['after']]
+        return 200, events
+
+    # Handles one API request.
+    # Input: method: the HTTP method
+    #        path: the part of the path after /api/v3/ or /api/v4/
+    #        params: the query string and body arguments
+    # Returns: (HTTP status, python object, name of the route or None)
+    def handle(self, method, path, params):
+        for route_method, regex, route, handler in self.routes:
+            match = regex.match(path)
+            if route_method == method and match:
+                params['_route'] = route
+                with self.lock:
+                    self.request_counts[route] += 1
+                    try:
+                        status, data = handler(params, match.groups())
+                    except MockError as e:
+                        status, data = e.status, {'message': e.message}
+                return status, data, route
+        with self.lock:
+            self.request_counts['%s (unknown)' % method] += 1
+        return 404, {'error': '404 Not Found'}, None
+
+
+# True if search is empty, or is in one of item's fields (ignoring case)
+def matches_search(item, search, fields):
+    if not search:
+        return True
+    return any(search.lower() in str(item.get(field, '')).lower() for field in fields)
+
+# Makes a commit with files on branch of the bare repo at repo_path (made
+# if needed), with git fast-import. Returns the commit id.
+# Input: files: a list of (path, content, 'text' or 'base64')
+#        parent: the commit id the branch is at now, or None
+def write_commit(repo_path, branch, files, message, parent, committed_at):
+    if not os.path.isdir(repo_path):
+        subprocess.run(['git', 'init', '-q', '--bare', repo_path], check=True)
+    stream = []
+    message_bytes = message.encode('utf-8')
+    stream.append(b'commit refs/heads/%s\n' % branch.encode('utf-8'))
+    stream.append(b'committer Mock Gitlab <mock@gitlab> %d +0000\n' % int(committed_at))
+    stream.append(b'data %d\n%s\n' % (len(message_bytes), message_bytes))
+    if parent:
+        stream.append(b'from %s\n' % parent.encode('ascii'))
+    for file_path, content, encoding in files:
+        data = base64.b64decode(content) if encoding == 'base64' else content.encode('utf-8')
+        stream.append(b'M 100644 inline %s\ndata %d\n%s\n' % (file_path.encode('utf-8'), len(data), data))
+    subprocess.run(['git', 'fast-import', '--quiet'], cwd=repo_path, input=b''.join(stream), check=True)
+    result = subprocess.run(['git', 'rev-parse', 'refs/heads/' + branch], cwd=repo_path,
+                            stdout=subprocess.PIPE, check=True)
+    return result.stdout.decode('ascii').strip()
+
+
+#
+# The HTTP side. Responses are paginated like Gitlab's, with the X-Page,
+# X-Next-Page, X-Total and Link headers.
+#
+class MockRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def do_PUT(self):
+        self.handle_api('PUT')
+
+    def do_DELETE(self):
+        self.handle_api('DELETE')
+
+    def handle_api(self, method):
+        gitlab = self.server.gitlab
+        parts = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if parts.path == '/_mock/stats':
+            return self.send_json(200, {'requests': gitlab.take_request_counts(), 'errors_sent': gitlab.errors_sent})
+        match = re.match('^/api/v[34]/(.*)$', parts.path)
+        if not match:
+            return self.send_json(404, {'error': '404 Not Found'})
+        if body:
+            if (self.headers.get('Content-Type') or '').startswith('application/json'):
+                try:
+                    params.update(json.loads(body.decode('utf-8')))
+                except ValueError:
+                    return self.send_json(400, {'message': 'Could not parse the JSON body'})
+            else:
+                params.update(urllib.parse.parse_qsl(body.decode('utf-8')))
+        if not self.headers.get('PRIVATE-TOKEN') and not self.headers.get('Authorization'):
+            return self.send_json(401, {'message': '401 Unauthorized'})
+
+        delay = gitlab.latency + (random.uniform(0, gitlab.jitter) if gitlab.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if gitlab.error_rate and random.random() < gitlab.error_rate:
+            with gitlab.lock:
+                gitlab.errors_sent += 1
+            headers = {}
+            if gitlab.error_status in (429, 503):
+                headers['Retry-After'] = str(gitlab.retry_after)
+            return self.send_json(gitlab.error_status, {'message': 'Error sent by mock_gitlab --error-rate'}, headers)
+
+        status, data, route = gitlab.handle(method, match.group(1), params)
+        headers = {}
+        if method == 'GET' and isinstance(data, list):
+            data, headers = self.paginate(data, params)
+        self.send_json(status, data, headers)
+
+    # Returns (the items on the requested page, pagination headers)
+    def paginate(self, items, params):
+        try:
+            page = max(1, int(params.get('page', 1)))
+            per_page = min(100, max(1, int(params.get('per_page', 20))))
+        except ValueError:
+            page, per_page = 1, 20
+        total_pages = max(1, (len(items) + per_page - 1) // per_page)
+        headers = {'X-Page': str(page), 'X-Per-Page': str(per_page), 'X-Total': str(len(items)),
+                   'X-Total-Pages': str(total_pages), 'X-Next-Page': str(page + 1) if page < total_pages else '',
+                   'X-Prev-Page': str(page - 1) if page > 1 else ''}
+        if page < total_pages:
+            parts = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(parts.query))
+            query.update({'page': str(page + 1), 'per_page': str(per_page)})
+            next_url = 'http://%s%s?%s' % (self.headers.get('Host'), parts.path, urllib.parse.urlencode(query))
+            headers['Link'] = '<%s>; rel="next"' % next_url
+        return items[(page - 1) * per_page:page * per_page], headers
+
+    def send_json(self, status, data, headers={}):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+class MockServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+# Starts serving gitlab on a background thread.
+# Input: gitlab: a MockGitlab
+#        port: the port to listen on. 0 picks a free one.
+# Returns: the server. Its URL (for GITLAB_URL) is
+#          'http://127.0.0.1:%d' % server.server_address[1]
+#          Call server.shutdown() to stop it.
+def start_server(gitlab, port=0, verbose=False):
+    server = MockServer(('127.0.0.1', port), MockRequestHandler)
+    server.gitlab = gitlab
+    server.verbose = verbose
+    gitlab.host = '127.0.0.1:%d' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a mock Gitlab server for trying out and benchmarking the scripts.")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on (on 127.0.0.1). Default is 8080.")
+    parser.add_argument('--repo-dir',
+                        help="Write commits made through the API to bare git repos in this folder, so they can be cloned.")
+    parser.add_argument('--latency', type=float, default=0, help="Seconds to wait before answering each API request.")
+    parser.add_argument('--jitter', type=float, default=0, help="Up to this many more seconds are waited, at random.")
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help="Fraction of API requests (0 to 1) to answer with an error instead.")
+    parser.add_argument('--error-status', type=int, default=500,
+                        help="HTTP status of the --error-rate errors. 429 and 503 get a Retry-After header. Default is 500.")
+    parser.add_argument('--retry-after', type=int, default=1, help="Seconds to send in Retry-After. Default is 1.")
+    parser.add_argument('--protect-delay', type=float, default=0,
+                        help="Seconds before a new master branch becomes protected. Default is 0.")
+    parser.add_argument('--verbose', action='store_true', help="Print every request.")
+    args = parser.parse_args()
+
+    gitlab = MockGitlab(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        error_status=args.error_status, retry_after=args.retry_after,
+                        protect_delay=args.protect_delay, repo_dir=args.repo_dir)
+    server = start_server(gitlab, args.port, args.verbose)
+    print("Mock Gitlab running at http://127.0.0.1:%d (ctrl-C to stop)" % server.server_address[1])
+    print("Request counts are at http://127.0.0.1:%d/_mock/stats" % server.server_address[1])
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
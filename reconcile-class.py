@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys,os,time
+import threading,concurrent.futures
+import urllib.parse
+import simple_gitlab
+import roster
+
+# This script brings Gitlab in line with a class list. It does the work of
+# create-users.py, create-class.py --add-students and
+# create-repos.py --add-students together, but instead of trying to create
+# everything and printing the errors for what already exists, it:
+#   1. gets what's already on the server in a few bulk listings: the group,
+#      its members, its projects (with whether each one has a master
+#      branch), and the users that aren't in the group yet
+#   2. compares that with the students in the class list
+#   3. does only what's missing, in order for each student: create their
+#      account, add them to the group, create their project, commit the
+#      seed files to it, and add them to it
+# So running it again after students join the class costs API requests for
+# the new students, not for the whole class. With --plan, the list of
+# changes is printed and nothing is changed.
+#
+# Nothing is ever removed. Students on Gitlab who aren't in the class list
+# any more are listed, so they can be dealt with by hand.
+
+# Pre-conditions:
+#   - Person using this script has admin access to the Gitlab server
+#   - The .CSV file has the registrar's format (see roster.py)
+
+# Post-conditions:
+#   - Every student in the course and section has an account, is a member of
+#     the group (as a guest), and has a project in the group with a master
+#     branch, which they're a developer of
+#   - Without --check-members, students are only added to projects created
+#     by this run (see --check-members)
+
+parser = argparse.ArgumentParser(description="Creates whatever is missing on Gitlab for the students in a class list.")
+parser.add_argument('--file-name', required=True, help="The .CSV file with the class list.")
+parser.add_argument('--course-name', required=True, help="The course (ex. CSCI408).")
+parser.add_argument('--course-section', required=True, help="The section of the course.")
+parser.add_argument('--token-file', default="/dev/stdin",
+                    help="Path to file containing your Gitlab private token. Default is to read from standard input.")
+parser.add_argument('--plan', action='store_true',
+                    help="Only print what would be changed. Nothing is changed on Gitlab.")
+parser.add_argument('--check-members', action='store_true',
+                    help="Also check who's a member of each existing project (one request per project), and add " +
+                         "students missing from their own project.")
+parser.add_argument('--seed-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'repo-template'),
+                    help="Folder with the files to put in each new repo. Default is the repo-template folder next to this script.")
+simple_gitlab.add_rate_limit_arguments(parser, jobs_help="Number of students to set up at the same time")
+simple_gitlab.add_profile_argument(parser)
+args = parser.parse_args()
+simple_gitlab.profile_from_args(args)
+jobs = simple_gitlab.rate_limit_from_args(args)
+
+course_name = args.course_name.lower()
+subject = course_name[0:4]
+course_number = course_name[4:7]
+group_name = subject + "-" + course_number + "-" + args.course_section
+
+# Access levels, as in create-class.py and create-repos.py
+guest_access = 10
+developer_access = 30
+
+try:
+    students = roster.load(args.file_name).section(course_number, args.course_section, subject=subject)
+except FileNotFoundError:
+    print("File %s could not be found." % args.file_name)
+    sys.exit(1)
+if not students:
+    print("No students could be found for %s section %s in %s." % (args.course_name, args.course_section, args.file_name))
+    sys.exit(1)
+
+seed_files = simple_gitlab.read_seed_files(args.seed_dir)
+if not seed_files:
+    print("There are no files in the seed directory %s. New repos need at least one file." % args.seed_dir)
+    sys.exit(1)
+
+simple_gitlab.set_private_token(args.token_file)
+
+#
+# Step 1: what's on the server now
+#
+
+# Returns the group called name, or None if there isn't one
+def find_group(name):
+    for group in simple_gitlab.request_pages('groups?search=%s' % urllib.parse.quote(name), quit_on_error=True):
+        if group['name'] == name or group['path'] == name:
+            return group
+    return None
+
+# Looks up the students that aren't known to have an account. If there are
+# many, every user is listed once; otherwise each one is searched for.
+# Returns: A dictionary of username -> user id, for the ones that exist
+def find_users(usernames):
+    if not usernames:
+        return {}
+    wanted = set(usernames)
+    user_ids = {}
+    if len(usernames) > simple_gitlab.bulk_user_lookup_threshold:
+        for user in simple_gitlab.request_pages('users', quit_on_error=True):
+            if user['username'] in wanted:
+                user_ids[user['username']] = user['id']
+        return user_ids
+    for username in usernames:
+        for user in simple_gitlab.request('users?username=%s' % urllib.parse.quote(username), quit_on_error=True):
+            if user['username'] == username:
+                user_ids[username] = user['id']
+    return user_ids
+
+# Returns the usernames of the members of a project
+def project_member_names(project_id):
+    return set(member['username'] for member in
+               simple_gitlab.request_pages('projects/%d/members' % project_id, quit_on_error=True))
+
+print("> Getting %s from Gitlab." % group_name)
+group = find_group(group_name)
+group_members = {}
+projects = {}
+if group:
+    for member in simple_gitlab.request_pages('groups/%d/members' % group['id'], quit_on_error=True):
+        group_members[member['username']] = member['id']
+    for project in simple_gitlab.request_pages('groups/%d/projects' % group['id'], quit_on_error=True):
+        projects[project['path']] = project
+
+# Everyone in the group has an account, so only the others are looked up
+user_ids = dict(group_members)
+user_ids.update(find_users([student.username for student in students if student.username not in group_members]))
+
+project_members = {}
+if args.check_members:
+    existing = [student.username for student in students if student.username in projects]
+    print("> Getting the members of %d projects." % len(existing))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for username, members in zip(existing, executor.map(lambda name: project_member_names(projects[name]['id']),
+                                                            existing)):
+            project_members[username] = members
+
+#
+# Step 2: what needs to change. The plan is a list, for each student, of
+# the steps still missing for them, in the order they have to be done.
+#
+
+# Returns the list of steps missing for student
+def student_steps(student):
+    username = student.username
+    steps = []
+    if username not in user_ids:
+        steps.append('create user')
+    if username not in group_members:
+        steps.append('add to group')
+    project = projects.get(username)
+    if project is None:
+        steps += ['create project', 'seed project', 'add to project']
+    else:
+        if not project.get('default_branch'):
+            steps.append('seed project')
+        if args.check_members and username not in project_members[username]:
+            steps.append('add to project')
+    return steps
+
+plan = [(student, student_steps(student)) for student in students]
+changes = [(student, steps) for student, steps in plan if steps]
+roster_usernames = set(student.username for student in students)
+not_in_roster = sorted(set(list(group_members) + list(projects)) - roster_usernames)
+
+step_names = ['create user', 'add to group', 'create project', 'seed project', 'add to project']
+step_counts = dict((step, sum(1 for student, steps in plan if step in steps)) for step in step_names)
+
+print(os.linesep)
+print("Plan for %s (%d students in %s):" % (group_name, len(students), args.file_name))
+if not group:
+    print("\tcreate group %s" % group_name)
+name_width = max([len(student.username) for student in students] + [len("Student")])
+for student, steps in changes:
+    print("\t%s   %s" % (student.username.ljust(name_width), ', '.join(steps)))
+if not group or changes:
+    print("Changes: %s" % ', '.join("%d %s" % (step_counts[step], step) for step in step_names if step_counts[step]))
+else:
+    print("\tNothing to do. Gitlab matches the class list.")
+if not args.check_members:
+    print("Project members were only checked for new projects. Use --check-members to check them all.")
+if not_in_roster:
+    print("On Gitlab but not in the class list (not changed): %s" % ', '.join(not_in_roster))
+
+if args.plan or (group and not changes):
+    sys.exit(0)
+
+#
+# Step 3: make the changes. Each student's steps are done in order, and
+# several students are set up at once (see --jobs). If a step fails, the
+# rest of that student's steps are skipped.
+#
+
+if not group:
+    group = simple_gitlab.request('groups', post_hash={'name': group_name, 'path': group_name})
+    if not group:
+        print("Could not create the group %s." % group_name)
+        sys.exit(1)
+    print("Gitlab group created with name %s" % group_name)
+
+print_lock = threading.Lock()
+
+# Does one step for student. Returns None if it worked, or an error message.
+def do_step(student, step, output):
+    username = student.username
+    if step == 'create user':
+        user = simple_gitlab.request('users', post_hash={'email': student.email,
+                                                         'password': student.last_name + student.email[2:8],
+                                                         'username': username,
+                                                         'name': student.name}, show_output=False)
+        if not user:
+            return "could not create the account (the username or email may be taken)"
+        user_ids[username] = user['id']
+    elif step == 'add to group':
+        return add_member('groups/%d/members' % group['id'], user_ids[username], guest_access)
+    elif step == 'create project':
+        project = simple_gitlab.request('projects', post_hash={'name': username, 'namespace_id': group['id'],
+                                                               'visibility_level': 0}, show_output=False)
+        if not project:
+            return "could not create the project"
+        projects[username] = project
+    elif step == 'seed project':
+        if not simple_gitlab.seed_repo(projects[username]['id'], seed_files, output.append):
+            return "could not commit the seed files"
+    elif step == 'add to project':
+        return add_member('projects/%d/members' % projects[username]['id'], user_ids[username], developer_access)
+    return None
+
+# Adds a member. Someone who's already a member counts as added.
+def add_member(query, user_id, access_level):
+    member = simple_gitlab.request(query, post_hash={'user_id': user_id, 'access_level': access_level},
+                                   show_output=False)
+    if member:
+        return None
+    # request() doesn't say why it failed, so check if they're a member after all
+    members = simple_gitlab.request(query.replace('/members', '/members/%d' % user_id), show_output=False)
+    return None if members else "could not add the member"
+
+# Returns: A short description of what was done, for the summary at the end
+def run_student(student, steps):
+    output = ["> %s: %s" % (student.username, ', '.join(steps))]
+    done = []
+    for step in steps:
+        try:
+            error = do_step(student, step, output)
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, str(e))
+        if error:
+            skipped = steps[len(done) + 1:]
+            outcome = "FAILED to %s (%s)" % (step, error)
+            if skipped:
+                outcome += ", skipped " + ', '.join(skipped)
+            output.append("> " + outcome)
+            break
+        done.append(step)
+    else:
+        outcome = ', '.join(done)
+    with print_lock:
+        print(os.linesep.join(output), flush=True)
+    return outcome
+
+start = time.time()
+print(os.linesep)
+print("> Setting up %d students, %d at a time." % (len(changes), jobs))
+with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    outcomes = list(executor.map(lambda change: run_student(*change), changes))
+
+print(os.linesep)
+print('-' * 60)
+print("Summary (%.1f seconds):" % (time.time() - start))
+print("\t%s   Outcome" % "Student".ljust(name_width))
+print("\t%s   ---------------" % ("-" * name_width))
+for (student, steps), outcome in zip(changes, outcomes):
+    print("\t%s   %s" % (student.username.ljust(name_width), outcome))
+failed = sum(1 for outcome in outcomes if outcome.startswith("FAILED"))
+if failed:
+    print("%d students could not be set up completely. Run this script again to retry what's missing." % failed)
+    sys.exit(1)
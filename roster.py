@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# Reads class lists for create-users.py, create-class.py and create-repos.py.
+#
+# A roster is a registrar export (.CSV) with one student per line:
+#     CSCI,408,1,SOFTWARE ENGINEERING,@00803819,Bob,Jim,5-Oct-97,jb123456@scots.edinboro.edu
+# that is: subject, course number, section, course title, student number,
+# last name, first name, birth date and email. Fields can be quoted, lines
+# with fewer fields (like blank lines) are skipped, and the file can be
+# UTF-8, UTF-16 (with a byte order mark) or Windows-1252.
+#
+# The file is read once, one line at a time, to find where each section's
+# students are in it. That index is saved next to the file (as
+# .FILENAME.index.json) and used again until the file changes, so picking
+# one section out of a big export of the whole university only reads that
+# section's lines:
+#     students = roster.load('all-courses.csv').section('408', '1', subject='CSCI')
+#     for student in students:
+#         print(student.username, student.first_name, student.last_name)
+
+import codecs,collections,csv,io
+import json,os,re
+
+# Bump this when the index file format changes, so old ones are rebuilt
+index_version = 1
+
+class Student(collections.namedtuple('Student', ['subject', 'course_number', 'section', 'title', 'student_id',
+                                                 'last_name', 'first_name', 'birth_date', 'email'])):
+    __slots__ = ()
+
+    # Gitlab username: the start of the Edinboro email address
+    @property
+    def username(self):
+        return self.email[0:8]
+
+    @property
+    def name(self):
+        return self.first_name + " " + self.last_name
+
+# Yields the lines of a binary file as strings, decoded as UTF-8, or as
+# Windows-1252 if a line isn't valid UTF-8. position.end is set to the byte
+# offset just past each line before it's yielded.
+def decode_lines(binary_file, position):
+    for line in binary_file:
+        position.end += len(line)
+        try:
+            yield line.decode('utf-8')
+        except UnicodeDecodeError:
+            yield line.decode('cp1252', errors='replace')
+
+class Position:
+    def __init__(self, start):
+        self.end = start
+
+# Returns the key a row is indexed under, or None if it isn't a student row
+def row_key(row):
+    if len(row) < len(Student._fields):
+        return None
+    return (row[0].strip().upper(), row[1].strip(), row[2].strip())
+
+def make_student(row):
+    return Student(*[field.strip() for field in row[:len(Student._fields)]])
+
+class Roster:
+    # Input: path: the registrar .CSV file
+    #        use_index: if False, the index isn't read from or saved to disk
+    def __init__(self, path, use_index=True):
+        self.path = path
+        self.use_index = use_index
+        stat = os.stat(path)
+        self.file_id = [stat.st_size, stat.st_mtime_ns, index_version]
+        self.index_path = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                       '.%s.index.json' % os.path.basename(path))
+        with open(path, 'rb') as f:
+            start = f.read(4)
+        if start.startswith(codecs.BOM_UTF16_LE) or start.startswith(codecs.BOM_UTF16_BE):
+            self.encoding = 'utf-16'
+        elif start.startswith(codecs.BOM_UTF8):
+            self.encoding = 'utf-8-sig'
+        else:
+            self.encoding = None
+        self.spans = None
+        if use_index and self.encoding != 'utf-16':
+            self.spans = self.load_index()
+
+    # Returns the saved index, or None if there isn't one for this version of the file
+    def load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get('file') != self.file_id:
+            return None
+        return dict((tuple(json.loads(key)), spans) for key, spans in saved['sections'].items())
+
+    def save_index(self):
+        sections = dict((json.dumps(list(key)), spans) for key, spans in self.spans.items())
+        try:
+            with open(self.index_path + '.tmp', 'w') as f:
+                json.dump({'file': self.file_id, 'sections': sections}, f)
+            os.replace(self.index_path + '.tmp', self.index_path)
+        except OSError:
+            # The folder might not be writable. The index is just made again next time.
+            pass
+
+    # Reads the whole file once and records, for each section, the byte
+    # ranges [start, end) its rows are in. Rows of the same section that
+    # are next to each other share one range.
+    def build_index(self):
+        spans = {}
+        with open(self.path, 'rb') as f:
+            if self.encoding == 'utf-8-sig':
+                f.seek(len(codecs.BOM_UTF8))
+            position = Position(f.tell())
+            reader = csv.reader(decode_lines(f, position))
+            while True:
+                start = position.end
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    break
+                key = row_key(row)
+                if key is None:
+                    continue
+                section_spans = spans.setdefault(key, [])
+                if section_spans and section_spans[-1][1] == start:
+                    section_spans[-1][1] = position.end
+                else:
+                    section_spans.append([start, position.end])
+        self.spans = spans
+        if self.use_index:
+            self.save_index()
+
+    # Yields every student row in the file
+    def all_rows(self):
+        with open(self.path, 'rb') as f:
+            if self.encoding == 'utf-16':
+                lines = io.TextIOWrapper(f, encoding='utf-16', newline='')
+            else:
+                if self.encoding == 'utf-8-sig':
+                    f.seek(len(codecs.BOM_UTF8))
+                lines = decode_lines(f, Position(f.tell()))
+            for row in csv.reader(lines):
+                if row_key(row) is not None:
+                    yield row
+
+    # Returns the list of Students in a section, in file order.
+    # Input: course_number: ex. '408'
+    #        section: ex. '1'
+    #        subject: ex. 'CSCI' (any case). If None, every subject with that
+    #                 course number and section is included.
+    def section(self, course_number, section, subject=None):
+        course_number = str(course_number).strip()
+        section = str(section).strip()
+        if self.encoding == 'utf-16':
+            # Byte offsets don't work with UTF-16 lines, so the file is read every time
+            return [make_student(row) for row in self.all_rows()
+                    if row_key(row)[1:] == (course_number, section) and
+                    (subject is None or row_key(row)[0] == subject.upper())]
+        if self.spans is None:
+            self.build_index()
+        keys = [key for key in self.spans if key[1:] == (course_number, section) and
+                (subject is None or key[0] == subject.upper())]
+        spans = sorted(span for key in keys for span in self.spans[key])
+        students = []
+        with open(self.path, 'rb') as f:
+            for start, end in spans:
+                f.seek(start)
+                data = f.read(end - start)
+                lines = decode_lines(io.BytesIO(data), Position(start))
+                for row in csv.reader(lines):
+                    key = row_key(row)
+                    if key in keys:
+                        students.append(make_student(row))
+        return students
+
+    # Returns the (subject, course number, section) of every section in the file
+    def sections(self):
+        if self.encoding == 'utf-16':
+            return sorted(set(row_key(row) for row in self.all_rows()))
+        if self.spans is None:
+            self.build_index()
+        return sorted(self.spans)
+
+# Returns a Roster for the registrar .CSV file at path.
+# Raises FileNotFoundError if it doesn't exist.
+def load(path, use_index=True):
+    return Roster(path, use_index)
+
+# Reads a .classlist file (from the student.cs Linux servers) and returns
+# the usernames in it, in order. Lines that don't start with a username
+# (2 letters and 6 digits) are skipped.
+def read_classlist(path):
+    classlist_regex = re.compile('[a-z]{2}[0-9]{6}')
+    usernames = []
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            match = classlist_regex.match(line)
+            if match:
+                usernames.append(match.group(0))
+    return usernames
@@ -2,55 +2,813 @@
 
 import os
 import gitlab
-import sys,getpass
-import json,urllib.request
+import sys,getpass,time,threading,re,random
+import collections,concurrent.futures,atexit
+import http.client,io,socket,email.utils,base64
+import json,urllib.request,urllib.parse,urllib.error
+import config
 from config import host_url
 
 private_token = ''
 
+
+# ------Connection pool------
+# urlopen makes a new TCP (and TLS, if use_ssl is set) connection for every
+# call. HTTPConnectionPool keeps a few keep-alive connections open per host
+# and hands them out to callers, so a script making thousands of API calls
+# only pays for a handful of handshakes. It is safe to share between threads.
+
+# What HTTPConnectionPool.urlopen returns. data is the whole body as bytes.
+HTTPResponse = collections.namedtuple('HTTPResponse', ['status', 'reason', 'headers', 'data'])
+
+class HTTPConnectionPool:
+    # Errors that mean a kept-alive connection was closed by the server while
+    # it was sitting in the pool. The request is tried again on a new connection.
+    stale_errors = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                    ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+    redirect_codes = (301, 302, 303, 307, 308)
+    max_redirects = 5
+
+    # Input:
+    #     max_size: most connections open to one host at the same time
+    #     idle_timeout: seconds an idle connection is kept before being closed
+    #     timeout: socket timeout in seconds for each connection
+    def __init__(self, max_size=config.http_pool_size, idle_timeout=config.http_pool_idle_timeout,
+                 timeout=config.http_timeout):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}   # (scheme, host, port) -> list of (connection, time last used)
+        self._slots = {}  # (scheme, host, port) -> semaphore bounding open connections
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_size)
+            return self._slots[key]
+
+    # Returns (connection, reused). Idle connections that have been sitting
+    # around longer than idle_timeout are closed instead of reused.
+    def _get_connection(self, key):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    return conn, True
+                conn.close()
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def _put_connection(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append((conn, time.monotonic()))
+
+    # Sends one request and reads the whole response. Redirects are followed
+    # for GET and HEAD requests only, like urlopen does.
+    # Raises urllib.error.HTTPError for 4xx and 5xx responses so callers
+    # see the same errors as they would from urlopen.
+    def urlopen(self, method, url, body=None, headers={}):
+        for redirect in range(self.max_redirects + 1):
+            response = self._send(method, url, body, headers)
+            location = response.headers.get('Location')
+            if response.status in self.redirect_codes and location and method in ('GET', 'HEAD'):
+                url = urllib.parse.urljoin(url, location)
+                continue
+            break
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason,
+                                         response.headers, io.BytesIO(response.data))
+        return response
+
+    def _send(self, method, url, body, headers):
+        parts = urllib.parse.urlsplit(url)
+        default_port = 443 if parts.scheme == 'https' else 80
+        key = (parts.scheme, parts.hostname, parts.port or default_port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        slot = self._slot(key)
+        with slot:
+            while True:
+                conn, reused = self._get_connection(key)
+                try:
+                    conn.request(method, path, body=body, headers=headers)
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except self.stale_errors:
+                    conn.close()
+                    if reused:
+                        continue
+                    raise
+                except Exception:
+                    conn.close()
+                    raise
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self._put_connection(key, conn)
+                return HTTPResponse(resp.status, resp.reason, resp.headers, data)
+
+    # Closes every idle connection. Connections in use are closed when
+    # they're returned.
+    def close_all(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, last_used in idle:
+                    conn.close()
+            self._idle = {}
+
+# The pool shared by everything in this module
+http_pool = HTTPConnectionPool()
+
+
+# ------Rate limiting------
+# RateLimiter is a token bucket that limits how many requests per second
+# are sent to Gitlab, and how many can be waiting on the server at once.
+# Use it in a "with" statement; the block starts once a request is allowed.
+# request() always goes through rate_limiter below, and so does every HTTP
+# request sent by a python-gitlab object from make_gitlab_obj, so each
+# request takes exactly one token. Don't put python-gitlab calls inside
+# "with rate_limiter:" as well.
+class RateLimiter:
+    # Input:
+    #     requests_per_second: how fast tokens are added to the bucket.
+    #                          None means no limit.
+    #     max_in_flight: most requests inside "with" at once. None means no limit.
+    #     burst: most tokens the bucket holds, ie how many requests can start
+    #            at once after a quiet period. Default is one second's worth.
+    def __init__(self, requests_per_second=None, max_in_flight=None, burst=None):
+        self.requests_per_second = requests_per_second
+        self.max_in_flight = max_in_flight
+        self.burst = burst or max(1, int(requests_per_second or 1))
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+    def acquire(self):
+        started = time.monotonic()
+        if self._in_flight:
+            self._in_flight.acquire()
+        if not self.requests_per_second:
+            request_metrics.add_wait(time.monotonic() - started)
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._last_refill) * self.requests_per_second)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    request_metrics.add_wait(now - started)
+                    return
+                wait = (1 - self._tokens) / self.requests_per_second
+            time.sleep(wait)
+
+    def release(self):
+        if self._in_flight:
+            self._in_flight.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+# ------Request metrics------
+# RequestMetrics counts every request sent to Gitlab, by endpoint (the
+# path with ids replaced by :id, ex. 'GET projects/:id/repository/branches'):
+# calls, errors, retries, bytes sent and received, and a histogram of how
+# long the requests took. Requests made by request(), async_gitlab and
+# python-gitlab objects from make_gitlab_obj are all counted.
+#
+# Nothing is kept unless profiling is on (the --profile option of the
+# scripts, or the GITLAB_PROFILE environment variable, see enable_profile)
+# or a hook has been added. Hooks are functions that are called with a
+# hash for every request, so the numbers can be sent somewhere else:
+#     def send_to_collector(event):
+#         ...  # event['endpoint'], event['seconds'], event['status'], ...
+#     simple_gitlab.add_metrics_hook(send_to_collector)
+# The hash has the keys:
+#   method, endpoint, url: what was requested
+#   status: the HTTP status, or None if there was no response
+#   seconds: how long the request took
+#   bytes_sent, bytes_received: size of the request and response bodies
+#   attempt: 1 for the first try, 2 for the first retry, and so on
+#   error: the error message, or None
+class RequestMetrics:
+    # Upper bounds (in seconds) of the latency histogram buckets
+    buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+    def __init__(self):
+        self.enabled = False
+        self.hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.wait_seconds = 0.0
+            self.started = time.time()
+
+    # Returns the endpoint name for a request, ex. 'GET projects/:id/members'
+    @staticmethod
+    def endpoint(method, url):
+        path = urllib.parse.urlsplit(url).path
+        path = re.sub('^.*?/api/v[0-9]+/', '', path)
+        path = re.sub('(^|/)[0-9]+(?=/|$)', '\\1:id', path)
+        return '%s %s' % (method, path)
+
+    def record(self, method, url, status, seconds, bytes_sent=0, bytes_received=0, attempt=1, error=None):
+        if not self.enabled and not self.hooks:
+            return
+        event = {'method': method, 'endpoint': self.endpoint(method, url), 'url': url,
+                 'status': status, 'seconds': seconds, 'bytes_sent': bytes_sent,
+                 'bytes_received': bytes_received, 'attempt': attempt, 'error': error}
+        if self.enabled:
+            with self._lock:
+                stats = self.endpoints.get(event['endpoint'])
+                if stats is None:
+                    stats = {'calls': 0, 'errors': 0, 'retries': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                             'bytes_sent': 0, 'bytes_received': 0, 'statuses': {},
+                             'histogram': [0] * len(self.buckets)}
+                    self.endpoints[event['endpoint']] = stats
+                stats['calls'] += 1
+                if error is not None or (status or 0) >= 400:
+                    stats['errors'] += 1
+                if attempt > 1:
+                    stats['retries'] += 1
+                stats['seconds'] += seconds
+                stats['max_seconds'] = max(stats['max_seconds'], seconds)
+                stats['bytes_sent'] += bytes_sent or 0
+                stats['bytes_received'] += bytes_received or 0
+                status_name = str(status) if status else 'no response'
+                stats['statuses'][status_name] = stats['statuses'].get(status_name, 0) + 1
+                for i, bucket in enumerate(self.buckets):
+                    if seconds <= bucket:
+                        stats['histogram'][i] += 1
+                        break
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception as e:
+                print("Metrics hook %s failed: %s" % (getattr(hook, '__name__', hook), e), file=sys.stderr)
+
+    # Adds time spent waiting for the rate limiter
+    def add_wait(self, seconds):
+        if self.enabled and seconds > 0:
+            with self._lock:
+                self.wait_seconds += seconds
+
+    # Returns an estimate of the fraction-th latency (ex. 0.95) of stats,
+    # as the upper bound of the histogram bucket it's in
+    def percentile(self, stats, fraction):
+        needed = fraction * stats['calls']
+        count = 0
+        for bucket, bucket_count in zip(self.buckets, stats['histogram']):
+            count += bucket_count
+            if count >= needed and count > 0:
+                return min(bucket, stats['max_seconds'])
+        return stats['max_seconds']
+
+    # Returns everything recorded as a hash that can be saved as JSON
+    def snapshot(self):
+        with self._lock:
+            endpoints = {}
+            for name, stats in self.endpoints.items():
+                endpoint = dict(stats)
+                endpoint['statuses'] = dict(stats['statuses'])
+                endpoint['histogram'] = dict(('le_%s' % ('inf' if bucket == float('inf') else bucket), count)
+                                             for bucket, count in zip(self.buckets, stats['histogram']))
+                endpoint['p50_seconds'] = self.percentile(stats, 0.5)
+                endpoint['p95_seconds'] = self.percentile(stats, 0.95)
+                endpoints[name] = endpoint
+            return {'script': os.path.basename(sys.argv[0]),
+                    'started_at': self.started,
+                    'wall_seconds': time.time() - self.started,
+                    'rate_limit_wait_seconds': self.wait_seconds,
+                    'endpoints': endpoints}
+
+    # Prints a table of the endpoints, slowest total time first
+    def print_summary(self, file=sys.stderr):
+        snapshot = self.snapshot()
+        endpoints = sorted(snapshot['endpoints'].items(), key=lambda item: -item[1]['seconds'])
+        name_width = max([len(name) for name, stats in endpoints] + [len("Endpoint")])
+        print("", file=file)
+        print("API requests made by %s in %.1f seconds:" % (snapshot['script'], snapshot['wall_seconds']), file=file)
+        print("\t%s   Calls  Errors  Retries  Total s   Avg ms   p50 ms   p95 ms   Max ms   KB sent   KB recv" %
+              "Endpoint".ljust(name_width), file=file)
+        print("\t%s   -----  ------  -------  -------  -------  -------  -------  -------  --------  --------" %
+              ("-" * name_width), file=file)
+        for name, stats in endpoints:
+            print("\t%s   %5d  %6d  %7d  %7.2f  %7.1f  %7.1f  %7.1f  %7.1f  %8.1f  %8.1f" %
+                  (name.ljust(name_width), stats['calls'], stats['errors'], stats['retries'], stats['seconds'],
+                   stats['seconds'] * 1000 / stats['calls'], stats['p50_seconds'] * 1000,
+                   stats['p95_seconds'] * 1000, stats['max_seconds'] * 1000,
+                   stats['bytes_sent'] / 1024.0, stats['bytes_received'] / 1024.0), file=file)
+        print("%d requests, %.1f seconds waiting for the rate limiter." %
+              (sum(stats['calls'] for name, stats in endpoints), snapshot['rate_limit_wait_seconds']), file=file)
+
+request_metrics = RequestMetrics()
+
+def add_metrics_hook(hook):
+    request_metrics.hooks.append(hook)
+
+def remove_metrics_hook(hook):
+    request_metrics.hooks.remove(hook)
+
+# Turns on request_metrics and prints its summary when the script exits.
+# Input: json_file: if given, the numbers are saved in this file as JSON
+#                   instead of being printed
+def enable_profile(json_file=None):
+    if request_metrics.enabled:
+        return
+    request_metrics.reset()
+    request_metrics.enabled = True
+
+    def write_profile():
+        if json_file:
+            with open(json_file, 'w') as f:
+                json.dump(request_metrics.snapshot(), f, indent=2, sort_keys=True)
+        else:
+            request_metrics.print_summary()
+    atexit.register(write_profile)
+
+# Adds the --profile option, which every script that talks to Gitlab has
+def add_profile_argument(parser):
+    parser.add_argument('--profile', nargs='?', const='', metavar='JSON_FILE',
+                        help="Print how many API requests were made to each endpoint and how long they took when " +
+                             "the script ends, or save it in JSON_FILE. Same as setting GITLAB_PROFILE.")
+
+# Turns on profiling if the script was run with --profile
+def profile_from_args(args):
+    if args.profile is not None:
+        enable_profile(args.profile or None)
+
+# How many things the scripts do at the same time by default: as many as
+# the requests that can wait on the server at once. When api_max_in_flight
+# is None (no limit), that's how many connections the pool keeps open.
+default_jobs = config.api_max_in_flight or config.http_pool_size
+
+# Adds the --rate and --max-in-flight options, which every script that sends
+# many API requests has. If jobs_help is given (ex. "Number of accounts to
+# create at the same time"), --jobs is added too, with default_jobs as its
+# default.
+def add_rate_limit_arguments(parser, jobs_help=None):
+    if jobs_help:
+        parser.add_argument('--jobs', type=int, default=default_jobs,
+                            help="%s. Default is %s." % (jobs_help, default_jobs))
+    parser.add_argument('--rate', type=float, default=config.api_requests_per_second,
+                        help="Most API requests to send per second. Default is %s (from config.py)." %
+                             config.api_requests_per_second)
+    parser.add_argument('--max-in-flight', type=int, default=config.api_max_in_flight,
+                        help="Most API requests waiting on the server at once. Default is %s (from config.py)." %
+                             config.api_max_in_flight)
+
+# Sets the rate limit from --rate and --max-in-flight.
+# Returns: the number of things to do at the same time, from --jobs (at
+#          least 1), or default_jobs if the script has no --jobs
+def rate_limit_from_args(args):
+    set_rate_limit(args.rate, args.max_in_flight)
+    return max(1, getattr(args, 'jobs', None) or default_jobs)
+
+# GITLAB_PROFILE=1 prints the summary, GITLAB_PROFILE=FILE saves it as JSON
+if os.environ.get('GITLAB_PROFILE'):
+    enable_profile(None if os.environ['GITLAB_PROFILE'].lower() in ('1', 'true', 'yes') else os.environ['GITLAB_PROFILE'])
+
+rate_limiter = RateLimiter(config.api_requests_per_second, config.api_max_in_flight)
+
+# Replaces the limits used by request(). Scripts call this with the values
+# from their command line arguments.
+def set_rate_limit(requests_per_second, max_in_flight):
+    global rate_limiter
+    rate_limiter = RateLimiter(requests_per_second, max_in_flight)
+
+# ------Retries------
+# RetryPolicy decides which failed requests request() tries again, and how
+# long it waits first. The wait doubles after each try (up to max_backoff),
+# minus a random part (the jitter) so that many workers that failed at the
+# same time don't all come back at the same time. If the server sent a
+# Retry-After header, at least that long is waited.
+# Only these are tried again:
+#   - errors in retry_statuses (ex. 502 Bad Gateway), for idempotent methods
+#     like GET and PUT. A POST that failed like that might have been done
+#     anyway, and doing it again could create something twice.
+#   - 429 Too Many Requests, for any method, since the server didn't do it
+#   - network errors, for idempotent methods (or any method if the
+#     connection was refused, since nothing was sent)
+# Other errors, like 404 Not Found, are not tried again.
+class RetryPolicy:
+    retry_statuses = (429, 500, 502, 503, 504)
+    any_method_statuses = (429,)
+    idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    # Input:
+    #     max_attempts: most tries in total, including the first
+    #     backoff: seconds to wait before the first retry
+    #     max_backoff: most seconds to wait between tries
+    #     jitter: fraction (0 to 1) of the wait that's random
+    #     max_retry_after: most seconds of a Retry-After header that are honoured
+    def __init__(self, max_attempts=config.api_max_attempts, backoff=config.api_retry_backoff,
+                 max_backoff=config.api_retry_max_backoff, jitter=0.5, max_retry_after=300):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+
+    # Returns True if a request with method that failed with error should be tried again
+    def should_retry(self, method, error):
+        if isinstance(error, urllib.error.HTTPError):
+            if error.code not in self.retry_statuses:
+                return False
+            return method in self.idempotent_methods or error.code in self.any_method_statuses
+        if isinstance(error, ConnectionRefusedError):
+            return True
+        return method in self.idempotent_methods and isinstance(error, (OSError, http.client.HTTPException))
+
+    # Returns the seconds to wait before try number attempt + 1
+    def delay(self, attempt, retry_after=None):
+        wait = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        wait -= wait * self.jitter * random.random()
+        if retry_after is not None:
+            wait = max(wait, min(retry_after, self.max_retry_after))
+        return wait
+
+# Returns the seconds in the Retry-After header of error, or None. The
+# header can be a number of seconds or a date.
+def retry_after_seconds(error):
+    headers = getattr(error, 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Returns True if error means the server is overloaded
+def is_overload(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in (429, 502, 503, 504)
+    return isinstance(error, (ConnectionRefusedError, TimeoutError, socket.timeout))
+
+# CircuitBreaker pauses every request (in all threads) when the server is
+# overloaded, instead of letting each worker keep retrying and make it
+# worse. All requests wait when the server sends a Retry-After header, or
+# for pause seconds after threshold overload errors (429, 502, 503, 504,
+# timeouts) in a row.
+class CircuitBreaker:
+    def __init__(self, threshold=config.api_overload_threshold, pause=config.api_overload_pause):
+        self.threshold = threshold
+        self.pause = pause
+        self._lock = threading.Lock()
+        self._overloads = 0
+        self._paused_until = 0.0
+
+    # Seconds until requests can be sent again
+    def pause_remaining(self):
+        with self._lock:
+            return max(0.0, self._paused_until - time.monotonic())
+
+    # Waits until requests can be sent again
+    def wait(self):
+        remaining = self.pause_remaining()
+        while remaining > 0:
+            time.sleep(remaining)
+            remaining = self.pause_remaining()
+
+    def record_success(self):
+        with self._lock:
+            self._overloads = 0
+
+    def record_overload(self, retry_after=None, show_output=True):
+        with self._lock:
+            now = time.monotonic()
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            self._overloads += 1
+            if self.threshold and self._overloads >= self.threshold:
+                self._overloads = 0
+                if now + self.pause > self._paused_until:
+                    self._paused_until = now + self.pause
+                    if show_output:
+                        print("Gitlab is overloaded. Pausing all requests for %.1f seconds." % self.pause)
+
+retry_policy = RetryPolicy()
+circuit_breaker = CircuitBreaker()
+
 # request makes a request to host_url/api/v3/
-# and returns the JSON data as a Python object
+# and returns the JSON data as a Python object. Connections are taken
+# from http_pool, so they're reused between calls. Failed requests are
+# tried again as retry_policy says, and wait while circuit_breaker is open.
 # Input: query: Part of URL after the URL above
 #        post_hash: A dictionary of data to send in a POST request
+#        post_json: Data to send as JSON instead of post_hash. Needed when the
+#                   data has lists or nested dictionaries.
 #        query_headers: Any headers you want to send as part of the request
-#        quit_on_error: If True, will quit program on error. If False, will
-#                       try 2 more times, and finially return false
+#        quit_on_error: If True, will quit program if the request fails
+#                       (after any retries). If False, returns False.
+#        max_attempts: Most tries, including the first. Default is
+#                      retry_policy.max_attempts.
+#        retry: A RetryPolicy to use instead of retry_policy
+#        return_headers: If True, returns (python object, response headers)
+#                        instead, or (False, None) on error
 # Returns: A python object
-def request(query, post_hash={}, query_headers={}, http_method=None, quit_on_error=False, max_attempts=3, show_output=True):
-    max_tries = 3
-    for request_attempt in list(range(1,max_tries+1)):
+def request(query, post_hash={}, query_headers={}, http_method=None, quit_on_error=False, max_attempts=None, show_output=True,
+            return_headers=False, post_json=None, retry=None):
+    policy = retry or retry_policy
+    max_tries = max_attempts or policy.max_attempts
+    url = host_url + "/api/v3/" + query
+    method, post_data, headers = request_data(post_hash, post_json, query_headers, http_method)
+    for request_attempt in range(1, max_tries + 1):
+        circuit_breaker.wait()
         try:
-            if 'PRIVATE-TOKEN' not in query_headers:
-                query_headers['PRIVATE-TOKEN'] = private_token
-            post_data = urllib.parse.urlencode(post_hash).encode('ascii') if post_hash else None
-            req = urllib.request.Request(url = host_url + "/api/v3/" + query,
-                                         data=post_data,
-                                         headers=query_headers,
-                                         method=http_method)
-            with urllib.request.urlopen(req) as f:
-                json_string = f.read().decode('utf-8')
+            with rate_limiter:
+                started = time.monotonic()
                 try:
-                    python_object = json.loads(json_string)
+                    response = http_pool.urlopen(method, url, body=post_data, headers=headers)
                 except Exception as e:
-                    if show_output:
-                        print(json_string)
-                        print("Error occurred trying to interpret above data as JSON.")
-                        print("Error message: %s" % str(e))
-                    if quit_on_error:
-                        sys.exit(1)
-                    else:
-                        return False
-                return python_object
+                    request_metrics.record(method, url, getattr(e, 'code', None), time.monotonic() - started,
+                                           len(post_data or b''), 0, request_attempt, str(e))
+                    raise
+                request_metrics.record(method, url, response.status, time.monotonic() - started,
+                                       len(post_data or b''), len(response.data), request_attempt)
         except Exception as e:
             if show_output:
-                print("Error occurred trying to access " + host_url + "/api/v3/" + query)
+                print("Error occurred trying to access " + url)
                 print("Error %s message: %s" % (type(e).__name__, str(e)))
+            retry_after = retry_after_seconds(e)
+            if is_overload(e):
+                circuit_breaker.record_overload(retry_after, show_output)
+            if request_attempt < max_tries and policy.should_retry(method, e):
+                delay = policy.delay(request_attempt, retry_after)
+                if show_output: print("Retrying in %.1f seconds... (re-try number %d)" % (delay, request_attempt))
+                time.sleep(delay)
+                continue
+            if show_output: print("Request failed after %d attempts" % request_attempt)
+            if quit_on_error:
+                sys.exit(1)
+            return (False, None) if return_headers else False
+        circuit_breaker.record_success()
+        json_string = response.data.decode('utf-8')
+        try:
+            python_object = json.loads(json_string)
+        except Exception as e:
+            if show_output:
+                print(json_string)
+                print("Error occurred trying to interpret above data as JSON.")
+                print("Error message: %s" % str(e))
             if quit_on_error:
                 sys.exit(1)
-            elif request_attempt < max_tries:
-                if show_output: print("Retrying... (re-try number %d)" % request_attempt)
-    if show_output: print("Request failed after %d attempts" % max_tries)
-    return False
+            else:
+                return (False, None) if return_headers else False
+        if return_headers:
+            return python_object, response.headers
+        return python_object
+
+# Works out what request() sends.
+# Input: the same arguments as request()
+# Returns: (HTTP method, body as bytes or None, dictionary of headers)
+def request_data(post_hash={}, post_json=None, query_headers={}, http_method=None):
+    headers = dict(query_headers)
+    if 'PRIVATE-TOKEN' not in headers:
+        headers['PRIVATE-TOKEN'] = private_token
+    if post_json is not None:
+        post_data = json.dumps(post_json).encode('utf-8')
+        headers.setdefault('Content-Type', 'application/json')
+    else:
+        post_data = urllib.parse.urlencode(post_hash).encode('ascii') if post_hash else None
+        if post_data is not None:
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+    method = http_method or ('POST' if post_data is not None else 'GET')
+    return method, post_data, headers
+
+# Raised by request_pages when a page can't be gotten (after any retries),
+# so that a list that was cut short isn't mistaken for the whole list.
+class PageRequestError(RuntimeError):
+    pass
+
+# request_pages is a generator over all the items returned by a query that
+# returns a JSON list, like 'projects/5/events'. Pages are requested one
+# at a time as the items are used, by following the X-Next-Page header
+# (or the Link header), so only one page is in memory at once. If the
+# caller stops looping early, the rest of the pages are never requested.
+# Input: query: Same as request(). Can already have arguments after '?'
+#        per_page: Number of items to ask for per page. Gitlab allows up to 100.
+#        Any other keyword arguments are passed to request(). With
+#        quit_on_error=True, the program quits if a page can't be gotten.
+# Yields: Python objects, one per item
+# Raises: PageRequestError if a page can't be gotten
+def request_pages(query, per_page=100, **request_args):
+    separator = '&' if '?' in query else '?'
+    first_page_query = query + separator + 'per_page=%d' % per_page
+    page_query = first_page_query
+    while page_query:
+        items, headers = request(page_query, return_headers=True, **request_args)
+        if items is False:
+            raise PageRequestError("Could not get %s" % page_query)
+        if not items:
+            return
+        for item in items:
+            yield item
+        page_query = next_page_query(first_page_query, headers)
+
+# Returns the query for the page after the one whose response headers are
+# given, or None if it was the last page.
+# Input: first_page_query: The query used for the first page
+#        headers: The response headers of the current page
+def next_page_query(first_page_query, headers):
+    next_page = headers.get('X-Next-Page')
+    if next_page:
+        return first_page_query + '&page=%s' % next_page
+    if next_page is not None:
+        # Header is there but empty: this was the last page
+        return None
+    # Older servers only send a Link header like
+    # <https://host/api/v3/projects/5/events?page=2&per_page=100>; rel="next"
+    for link in headers.get('Link', '').split(','):
+        match = re.search('<([^>]*)>\\s*;\\s*rel="next"', link)
+        if match:
+            return match.group(1).split('/api/v3/', 1)[-1]
+    return None
+
+# ------Polling------
+# Poller checks things in a background thread until they're ready, ex.
+# until Gitlab has protected a new master branch. Each key is checked as
+# soon as it's added, so how long it took to be ready is measured from when
+# it was added, not from when the caller got around to waiting. The wait
+# between checks of a key doubles each time (up to max_delay), with random
+# jitter so that several scripts polling at the same time don't line up.
+# Gitlab has no API that gives the state of many projects' branches at
+# once, so this is still one check (ex. one GET) per key that isn't ready,
+# just without a loop per key polling every second.
+#     poller = simple_gitlab.Poller(check, timeout=300)
+#     poller.add(project_id)     # as each one is created
+#     settle_times = poller.finish()
+class Poller:
+    # Input:
+    #     check: function taking a key. Returns something true when key is ready.
+    #     timeout: seconds after a key is added before giving up on it
+    #     initial_delay, max_delay: seconds to wait between checks of a key
+    #     backoff: how much the wait grows after each check
+    #     jitter: the wait is randomly made up to this fraction longer or shorter
+    #     on_ready: optional function called with (key, seconds) when key is ready.
+    #               It's called from the background thread.
+    def __init__(self, check, timeout=120, initial_delay=0.5, max_delay=10, backoff=2, jitter=0.25, on_ready=None):
+        self.check = check
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.on_ready = on_ready
+        # key -> seconds it took to be ready, or None if it isn't (yet)
+        self.settle_times = {}
+        # key -> [time.monotonic() it was added, time of the next check, wait after that check]
+        self._pending = {}
+        self._finishing = False
+        self._changed = threading.Condition()
+        self._thread = None
+
+    # Starts checking key. start_time is the time.monotonic() it started
+    # waiting, if that was before now (ex. it was created by an earlier run).
+    def add(self, key, start_time=None):
+        start = time.monotonic() if start_time is None else start_time
+        with self._changed:
+            self.settle_times[key] = None
+            self._pending[key] = [start, start + self.initial_delay, self.initial_delay * self.backoff]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._changed.notify()
+
+    # Waits until every key is ready or has timed out.
+    # Returns: A dictionary of key -> seconds it took to be ready, or None if it
+    #          wasn't ready before the timeout
+    def finish(self):
+        with self._changed:
+            self._finishing = True
+            self._changed.notify()
+        if self._thread is not None:
+            self._thread.join()
+        return self.settle_times
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while True:
+                    if not self._pending and self._finishing:
+                        return
+                    now = time.monotonic()
+                    due = [key for key, (start, next_check, delay) in self._pending.items() if next_check <= now]
+                    if due:
+                        break
+                    self._changed.wait(min(next_check for start, next_check, delay in self._pending.values()) - now
+                                       if self._pending else None)
+            for key in due:
+                try:
+                    ready = self.check(key)
+                except Exception:
+                    ready = False
+                now = time.monotonic()
+                with self._changed:
+                    start, next_check, delay = self._pending[key]
+                    if ready:
+                        del self._pending[key]
+                        self.settle_times[key] = now - start
+                    elif now - start >= self.timeout:
+                        del self._pending[key]
+                    else:
+                        self._pending[key] = [start, now + delay * random.uniform(1 - self.jitter, 1 + self.jitter),
+                                              min(self.max_delay, delay * self.backoff)]
+                if ready and self.on_ready:
+                    self.on_ready(key, now - start)
+
+# Waits for every key in keys with a Poller.
+# Input:
+#     start_times: optional dictionary of key -> time.monotonic() when that key
+#                  started waiting. Default is when wait_for_all was called.
+#     The rest are the same as for Poller.
+# Returns: A dictionary of key -> seconds it took to be ready, or None if it
+#          wasn't ready before the timeout
+def wait_for_all(keys, check, start_times={}, **poll_args):
+    poller = Poller(check, **poll_args)
+    for key in keys:
+        poller.add(key, start_times.get(key))
+    return poller.finish()
+
+# Same as wait_for_all, for one thing. check takes no arguments.
+# Returns the seconds it took to be ready, or None if it timed out.
+def wait_for(check, **wait_args):
+    return wait_for_all([None], lambda key: check(), **wait_args)[None]
+
+# ------Seeding repos------
+# New student repos start with the files in a seed folder (repo-template by
+# default), committed to the master branch.
+
+# Reads the files that every new repo starts with from seed_dir.
+# Returns: A list of hashes, each hash containing the keys:
+#   file_path: A string, the path of the file in the repo, ex. 'A0/.gitignore'
+#   content: A string, the file's contents (base64 encoded if encoding is 'base64')
+#   encoding: 'text' or 'base64'. Files that aren't UTF-8 text are base64 encoded.
+def read_seed_files(seed_dir):
+    seed_files = []
+    for dir_path, dir_names, file_names in os.walk(seed_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            file_path = os.path.relpath(path, seed_dir).replace(os.sep, '/')
+            try:
+                seed_files.append({'file_path': file_path, 'content': data.decode('utf-8'), 'encoding': 'text'})
+            except UnicodeDecodeError:
+                seed_files.append({'file_path': file_path, 'content': base64.b64encode(data).decode('ascii'),
+                                   'encoding': 'base64'})
+    return seed_files
+
+# Creates the master branch of project_id with all of seed_files in one
+# commit. If the server doesn't have the commits API, the files are
+# created one commit at a time instead.
+# Input: project_id: the project to commit to
+#        seed_files: the list returned by read_seed_files
+#        log: function called with each line of output. Default is print.
+# Returns: True if all the files were committed
+def seed_repo(project_id, seed_files, log=print):
+    seed_folders = sorted(set(seed_file['file_path'].split('/')[0] for seed_file in seed_files))
+    log("> Committing %d files (%s)" % (len(seed_files), ', '.join(seed_folders)))
+    actions = [{'action': 'create',
+                'file_path': seed_file['file_path'],
+                'content': seed_file['content'],
+                'encoding': seed_file['encoding']} for seed_file in seed_files]
+    commit = request('projects/%d/repository/commits' % project_id,
+                     post_json={'branch_name': "master", 'commit_message': "Creating %s" % ', '.join(seed_folders),
+                                'actions': actions})
+    if commit:
+        return True
+    log("> Could not create one commit. Creating the files one at a time.")
+    all_created = True
+    for seed_file in seed_files:
+        log("> Creating %s" % seed_file['file_path'])
+        created = request('projects/%d/repository/files' % project_id,
+                post_hash={'file_path': seed_file['file_path'], 'branch_name': "master",
+                           'content': seed_file['content'], 'encoding': seed_file['encoding'],
+                           'commit_message': "Creating %s" % seed_file['file_path']})
+        all_created = all_created and bool(created)
+    return all_created
 
 # Read private token from token_file. Mutates the global private_token
 # above and returns it too.
@@ -79,7 +837,12 @@ def set_private_token(token_file):
 # Returns the group id (an integer) of group_name. If group_name could
 # not be found, prints the groups available and exit.
 def get_group_id(group_name):
-    groups_data = request('groups')
+    return find_group_id(request('groups', quit_on_error=True), group_name)
+
+# Returns the id of the group named group_name in groups_data, the list
+# returned by the 'groups' query. If it isn't there, prints the groups
+# available and exit.
+def find_group_id(groups_data, group_name):
     for group in groups_data:
         if group['name'] == group_name:
             return group['id']
@@ -126,7 +889,31 @@ def make_gitlab_obj(url=host_url, token=None, token_filename=None):
         # for now, just leave it as anonymous API access
         pass
     
-    return gitlab.Gitlab(url, private_token=token)
+    gl = gitlab.Gitlab(url, private_token=token)
+    # Count python-gitlab's requests in request_metrics too
+    gl.session.hooks['response'].append(record_session_response)
+    # Each request python-gitlab sends (ex. every page of a list) takes its own rate_limiter token
+    send = gl.session.send
+    sending = threading.local()
+    def limited_send(*send_args, **send_kwargs):
+        # requests calls send again to follow redirects. Those go out under the
+        # first request's token, so a full max_in_flight can't deadlock.
+        if getattr(sending, 'active', False):
+            return send(*send_args, **send_kwargs)
+        sending.active = True
+        try:
+            with rate_limiter:
+                return send(*send_args, **send_kwargs)
+        finally:
+            sending.active = False
+    gl.session.send = limited_send
+    return gl
+
+# A requests response hook that records python-gitlab's requests in request_metrics
+def record_session_response(response, *args, **kwargs):
+    body = response.request.body
+    request_metrics.record(response.request.method, response.url, response.status_code,
+                           response.elapsed.total_seconds(), len(body or b''), len(response.content))
 
 # Helper function for search error handling.
 # Raise an error if there are multpile results from a GitLab search
@@ -146,14 +933,120 @@ def bad_search_check(result, lst_name, item_name):
 # Input:
 #     lst: a list of GitLab objects which have names, i.e., groups
 #     name: the name of the desired object
-def search_match(lst, name):
-    return list(filter(lambda item: item.name == name, lst))
+#     attr: the attribute holding the name. Users are found by "username".
+def search_match(lst, name, attr='name'):
+    return list(filter(lambda item: getattr(item, attr) == name, lst))
+
+
+# ------Name cache------
+# NameCache remembers the users, groups and projects found by the
+# get_*_by_name functions below, so looking one up again is a dictionary
+# lookup instead of a search on the server. Entries are forgotten after
+# ttl seconds. Call invalidate() after creating, renaming or deleting
+# something so the next lookup goes to the server. Everything in this
+# module uses the shared name_cache.
+#
+# Entries are stored under (kind, key), where kind is 'users', 'groups' or
+# 'projects'. Keys are usernames, group names, and (group name, project
+# name) pairs for projects.
+#
+# The cache can be saved to a JSON file and loaded by a later run. Only the
+# objects' attributes are saved; they're made into python-gitlab objects
+# again the first time they're looked up.
+class NameCache:
+    def __init__(self, ttl=config.name_cache_ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}        # (kind, key) -> (object or attribute dictionary, time stored)
+        self._loaded_scopes = {}  # (kind, scope) -> time a full listing was stored
+
+    def get(self, kind, key):
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry and time.time() - entry[1] <= self.ttl:
+                return entry[0]
+            return None
+
+    def put(self, kind, key, obj, stored_at=None):
+        with self._lock:
+            self._entries[(kind, key)] = (obj, stored_at or time.time())
+
+    # Input: kind: 'users', 'groups' or 'projects', or None to forget everything
+    #        key: the entry to forget, or None to forget every entry of kind
+    def invalidate(self, kind=None, key=None):
+        with self._lock:
+            for entry_kind, entry_key in list(self._entries):
+                if (kind is None or entry_kind == kind) and (key is None or entry_key == key):
+                    del self._entries[(entry_kind, entry_key)]
+            if key is None:
+                for scope in list(self._loaded_scopes):
+                    if kind is None or scope[0] == kind:
+                        del self._loaded_scopes[scope]
+
+    # Used to remember that every object in a scope (ex. all users, or all
+    # projects of a group) was stored by one listing, so it isn't listed again.
+    def mark_loaded(self, kind, scope=None):
+        with self._lock:
+            self._loaded_scopes[(kind, scope)] = time.time()
+
+    def is_loaded(self, kind, scope=None):
+        with self._lock:
+            loaded_at = self._loaded_scopes.get((kind, scope))
+            return loaded_at is not None and time.time() - loaded_at <= self.ttl
+
+    # Saves the attributes of every entry to filename as JSON
+    def save(self, filename):
+        with self._lock:
+            entries = []
+            for (kind, key), (obj, stored_at) in self._entries.items():
+                attributes = obj if isinstance(obj, dict) else obj.attributes
+                entries.append({'kind': kind, 'key': key, 'stored_at': stored_at, 'attributes': attributes})
+            loaded_scopes = [{'kind': kind, 'scope': scope, 'stored_at': stored_at}
+                             for (kind, scope), stored_at in self._loaded_scopes.items()]
+        with open(filename + '.tmp', 'w') as f:
+            json.dump({'entries': entries, 'loaded_scopes': loaded_scopes}, f)
+        os.replace(filename + '.tmp', filename)
+
+    # Loads entries saved by save(). Entries older than ttl are skipped.
+    # It's fine if filename doesn't exist yet.
+    def load(self, filename):
+        try:
+            with open(filename, 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            print("Could not read name cache %s. Error message: %s" % (filename, str(e)))
+            return
+        for entry in saved['entries']:
+            key = tuple(entry['key']) if isinstance(entry['key'], list) else entry['key']
+            if time.time() - entry['stored_at'] <= self.ttl:
+                self.put(entry['kind'], key, entry['attributes'], stored_at=entry['stored_at'])
+        with self._lock:
+            for scope in saved.get('loaded_scopes', []):
+                if time.time() - scope['stored_at'] <= self.ttl:
+                    self._loaded_scopes[(scope['kind'], scope['scope'])] = scope['stored_at']
+
+name_cache = NameCache()
+
+# Looks up (kind, key) in name_cache. Objects loaded from a file are made
+# into python-gitlab objects of manager's type. Returns None if not cached.
+def cached_object(kind, key, manager):
+    obj = name_cache.get(kind, key)
+    if isinstance(obj, dict):
+        obj = manager._obj_cls(manager, obj)
+        name_cache.put(kind, key, obj)
+    return obj
 
 # returns group object
 # Input:
 #     gl: the GitLab object
 #     name: the name of the group
 def get_group_by_name(gl, name):
+    group = cached_object('groups', name, gl.groups)
+    if group:
+        return group
+
     # TODO: paginate below list later when there are many groups
     groups = gl.groups.list(all=True,search=name)
     groups = search_match(groups, name)
@@ -161,24 +1054,45 @@ def get_group_by_name(gl, name):
     # there should only be one group with this name
     bad_search_check(groups, "groups", name)
 
+    name_cache.put('groups', name, groups[0])
     return groups[0]
 
 
-# retrieve a user, given their name
+# Gets every user on the server in one listing and puts them in
+# name_cache, so get_user_by_name doesn't search for each one.
+# Scripts that look up many users, like a whole class, should call this once first.
 # Input:
 #     gl: the GitLab object
-#     name: the name of the user
+def load_all_users(gl):
+    if name_cache.is_loaded('users'):
+        return
+    for user in gl.users.list(all=True, per_page=100):
+        name_cache.put('users', user.username, user)
+    name_cache.mark_loaded('users')
+
+
+# retrieve a user, given their username
+# Input:
+#     gl: the GitLab object
+#     name: the username of the user
 def get_user_by_name(gl, name):
+    user = cached_object('users', name, gl.users)
+    if user:
+        return user
+
     users = gl.users.list(all=True,username=name)
-    users = search_match(users, name)
+    users = search_match(users, name, attr='username')
 
     # there should only be one user with this name
     bad_search_check(users, "users", name)
 
+    name_cache.put('users', name, users[0])
     return users[0]
 
 
 # retrieve a project, given its name
+# The first time a project in a group is looked up, all the group's
+# projects are listed and cached, so the rest are found without searching.
 # Input:
 #     gl: the GitLab object
 #     name: the name of the project
@@ -187,19 +1101,76 @@ def get_project_by_name(gl, name, g_name=None):
     projects = None
     if g_name:
         group = get_group_by_name(gl, g_name)
+        if not name_cache.is_loaded('projects', g_name):
+            for project in group.projects.list(all=True):
+                name_cache.put('projects', (g_name, project.name), project)
+            name_cache.mark_loaded('projects', g_name)
+        project = cached_object('projects', (g_name, name), group.projects)
+        if project:
+            return project
 
         # get the project by its name
         projects = group.projects.list(all=True,search=name)
     else:
+        project = cached_object('projects', (None, name), gl.projects)
+        if project:
+            return project
         projects = gl.projects.list(all=True,search=name)
 
     projects = search_match(projects, name)
 
     bad_search_check(projects, "projects", name)
 
+    name_cache.put('projects', (g_name, name), projects[0])
     return projects[0]
 
 
+# add_members looks up every user on the server in one listing when adding
+# more than this many users, instead of searching for each of them
+bulk_user_lookup_threshold = 5
+
+# Adds many users to a group or project at once. All the users are looked
+# up first (with one listing of every user if there are many), then the
+# memberships are created jobs at a time. A user who is already a member
+# (error 409) counts as added. Errors don't stop the other users from
+# being added; they're returned instead.
+# Input:
+#     gl: the GitLab object
+#     target: the group or project object to add the users to
+#     usernames: list of usernames to add
+#     access_level: the users' access level, ex. gitlab.DEVELOPER_ACCESS
+#     jobs: number of memberships to create at the same time. Default is default_jobs.
+# Returns: A dictionary of username -> None if the user is now a member,
+#          or the exception if they couldn't be added
+def add_members(gl, target, usernames, access_level=gitlab.DEVELOPER_ACCESS, jobs=None):
+    if len(usernames) > bulk_user_lookup_threshold:
+        load_all_users(gl)
+    errors = {}
+    user_ids = {}
+    for username in usernames:
+        try:
+            user_ids[username] = get_user_by_name(gl, username).id
+        except Exception as e:
+            errors[username] = e
+
+    def add_member(username):
+        try:
+            target.members.create({'user_id': user_ids[username],
+                                   'access_level': access_level})
+        except gitlab.exceptions.GitlabCreateError as e:
+            # "error 409: Member already exists" means there's nothing to do
+            if e.response_code != 409:
+                return e
+        except Exception as e:
+            return e
+        return None
+
+    found_usernames = list(user_ids)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs or default_jobs)) as executor:
+        for username, error in zip(found_usernames, executor.map(add_member, found_usernames)):
+            errors[username] = error
+    return dict((username, errors.get(username)) for username in usernames)
+
 # add users to a group
 # adds users from a list of usernames to a group
 # this is mainly a test function
@@ -213,18 +1184,13 @@ def add_users_to_group(gl, g_name, new_users):
     except RuntimeError as e:
         print("Finding group failed with name: %s" % e)
         sys.exit(1)
-        
+
+    results = add_members(gl, group, new_users)
     for username in new_users:
-        # print(get_user_by_name(gl, username))
-        user = get_user_by_name(gl, username)
-        try:
-            group.members.create({'user_id': user.id,
-                                  'access_level': gitlab.DEVELOPER_ACCESS})
-            print("User %s added to group %s" % (user.name, group.name))
-        except gitlab.exceptions.GitlabCreateError as e:
-            # The expected error is "error 409: Member already exists"
-            # Just keep going
-            print("Encountered error: %s\nContinuing" % e)
+        if results[username] is None:
+            print("User %s added to group %s" % (username, group.name))
+        else:
+            print("Could not add user %s to group %s. Encountered error: %s" % (username, group.name, results[username]))
 
 # add a user to a project in a given group
 # Input:
@@ -235,8 +1201,9 @@ def add_users_to_group(gl, g_name, new_users):
 def add_user_to_project(gl, user_id, proj_name, g_name=None):
     group_project = get_project_by_name(gl, proj_name, g_name=g_name)
 
-    # convert GroupProject object to Project, so we can see its members
-    project = gl.projects.get(group_project.id)
+    # convert GroupProject object to Project, so we can see its members.
+    # lazy=True skips fetching the project; only its id is needed.
+    project = gl.projects.get(group_project.id, lazy=True)
 
     # print("Student user id is %s" % user_id) # checking student id
     # print(project.members.list(),project.name) # .members checking